@@ -0,0 +1,179 @@
+from datetime import datetime
+from typing import Optional
+from pymongo import UpdateOne
+from loaders import load_products
+
+def _bucket_update(kind: str, key: str, inc: dict, set_fields: dict = None) -> UpdateOne:
+    update = {"$inc": inc, "$setOnInsert": {"kind": kind, "key": key}}
+    if set_fields:
+        update["$set"] = set_fields
+    return UpdateOne({"_id": f"{kind}:{key}"}, update, upsert=True)
+
+def _order_placed_updates(order: dict) -> list:
+    return [
+        _bucket_update("product", item["product_id"],
+                       {"quantity": item["quantity"]},
+                       {"name": item.get("product_name")})
+        for item in order.get("items", [])
+    ]
+
+def _payment_completed_updates(order: dict, product_map: dict, sign: int = 1) -> list:
+    """Revenue bucket increments for a paid order; sign=-1 takes them back out"""
+    total = sign * order.get("total", 0)
+    created_at = order.get("created_at") or datetime.now()
+    requests = [
+        _bucket_update("total", "all", {"revenue": total, "orders": sign}),
+        _bucket_update("day", created_at.strftime("%Y-%m-%d"), {"revenue": total, "orders": sign}),
+        _bucket_update("month", created_at.strftime("%Y-%m"), {"revenue": total, "orders": sign}),
+    ]
+    category_revenue = {}
+    for item in order.get("items", []):
+        product = product_map.get(item["product_id"])
+        if product:
+            category = product.get("category", "Other")
+            category_revenue[category] = category_revenue.get(category, 0) + sign * item["total"]
+    for category, revenue in category_revenue.items():
+        requests.append(_bucket_update("category", category, {"revenue": revenue}))
+    return requests
+
+async def record_order_placed(order: dict, rollups_collection):
+    """Count units sold per product when an order is created"""
+    requests = _order_placed_updates(order)
+    if requests:
+        await rollups_collection.bulk_write(requests, ordered=False)
+
+async def record_payment_completed(order: dict, rollups_collection, products_collection):
+    """Add a paid order's revenue to the total, day, month and category buckets"""
+    product_map = await load_products(
+        [item["product_id"] for item in order.get("items", [])],
+        products_collection, {"category": 1}
+    )
+    await rollups_collection.bulk_write(
+        _payment_completed_updates(order, product_map), ordered=False
+    )
+
+async def record_payment_reversed(order: dict, rollups_collection, products_collection):
+    """Remove an order's revenue again when it leaves Completed (refund, admin correction)"""
+    product_map = await load_products(
+        [item["product_id"] for item in order.get("items", [])],
+        products_collection, {"category": 1}
+    )
+    await rollups_collection.bulk_write(
+        _payment_completed_updates(order, product_map, sign=-1), ordered=False
+    )
+
+async def get_sales_rollups(rollups_collection, top_limit: int = 10) -> dict:
+    """Read the precomputed sales buckets"""
+    total = await rollups_collection.find_one({"_id": "total:all"}) or {}
+    
+    revenue_by_category = {}
+    revenue_by_month = []
+    async for bucket in rollups_collection.find({"kind": {"$in": ["category", "month"]}}).sort("key", 1):
+        if bucket["kind"] == "category":
+            revenue_by_category[bucket["key"]] = bucket.get("revenue", 0)
+        else:
+            revenue_by_month.append({"month": bucket["key"], "revenue": bucket.get("revenue", 0)})
+    
+    top_products = []
+    async for bucket in rollups_collection.find({"kind": "product"}).sort("quantity", -1).limit(top_limit):
+        top_products.append({
+            "id": bucket["key"],
+            "name": bucket.get("name"),
+            "sales": bucket.get("quantity", 0)
+        })
+    
+    return {
+        "total_revenue": total.get("revenue", 0.0),
+        "revenue_by_category": revenue_by_category,
+        "revenue_by_month": revenue_by_month,
+        "top_products": top_products
+    }
+
+async def get_payment_totals(payments_collection, start_date: Optional[datetime] = None,
+                             end_date: Optional[datetime] = None) -> dict:
+    """Aggregate payment amounts by status, method and day on the server"""
+    pipeline = []
+    date_range = {}
+    if start_date:
+        date_range["$gte"] = start_date
+    if end_date:
+        date_range["$lte"] = end_date
+    if date_range:
+        pipeline.append({"$match": {"created_at": date_range}})
+    pipeline.append({"$group": {
+        "_id": {
+            "status": {"$ifNull": ["$status", "pending"]},
+            "method": {"$ifNull": ["$payment_method", "Unknown"]},
+            "day": {"$dateToString": {
+                "format": "%Y-%m-%d",
+                "date": {"$ifNull": ["$created_at", "$$NOW"]}
+            }}
+        },
+        "amount": {"$sum": {"$ifNull": ["$amount", 0]}}
+    }})
+    
+    by_status = {}
+    by_method = {}
+    by_date = {}
+    async for bucket in payments_collection.aggregate(pipeline):
+        key = bucket["_id"]
+        amount = bucket["amount"]
+        by_status[key["status"]] = by_status.get(key["status"], 0) + amount
+        by_method[key["method"]] = by_method.get(key["method"], 0) + amount
+        by_date[key["day"]] = by_date.get(key["day"], 0) + amount
+    
+    return {
+        "by_status": by_status,
+        "by_method": by_method,
+        "by_date": [{"date": k, "amount": v} for k, v in sorted(by_date.items())]
+    }
+
+async def rebuild_sales_rollups(orders_collection, rollups_collection,
+                                products_collection, batch_size: int = 500):
+    """Recompute every bucket from the orders collection.
+    
+    Buckets are built in a scratch collection and swapped in with one rename,
+    so the dashboard keeps reading the old rollups until the new ones are ready.
+    Increments made while the scan runs go to the old collection and are
+    dropped by the swap, so run this with order and payment writes paused:
+    stop the API processes (each runs a reconciliation worker) first.
+    """
+    from indexes import INDEX_PLAN
+    scratch = rollups_collection.database[f"{rollups_collection.name}_rebuild"]
+    await scratch.drop()
+    models = INDEX_PLAN.get(rollups_collection.name)
+    if models:
+        await scratch.create_indexes(models)
+    count = 0
+    cursor = orders_collection.find().batch_size(batch_size)
+    while True:
+        batch = await cursor.to_list(batch_size)
+        if not batch:
+            break
+        paid = [o for o in batch if o.get("payment_status") == "Completed"]
+        product_map = await load_products(
+            [item["product_id"] for o in paid for item in o.get("items", [])],
+            products_collection, {"category": 1}
+        )
+        requests = []
+        for order in batch:
+            requests += _order_placed_updates(order)
+        for order in paid:
+            requests += _payment_completed_updates(order, product_map)
+        if requests:
+            await scratch.bulk_write(requests)
+        count += len(batch)
+    await scratch.rename(rollups_collection.name, dropTarget=True)
+    return count
+
+if __name__ == "__main__":
+    import asyncio
+    import sys
+    from database import orders, products, sales_rollups
+    
+    if len(sys.argv) < 2 or sys.argv[1] != "rebuild":
+        print("Usage: python analytics.py rebuild")
+        print("Stop the API servers first; orders paid or refunded during a rebuild are lost from the rollups.")
+        sys.exit(1)
+    processed = asyncio.run(rebuild_sales_rollups(orders, sales_rollups, products))
+    print(f"[OK] Rebuilt sales rollups from {processed} orders")
@@ -1,18 +1,78 @@
 from passlib.context import CryptContext
 from jose import jwt
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from cache import LRUCache
+import asyncio
+import hashlib
+import os
+import time
 
 SECRET_KEY = "SECRET_KEY_123"
 ALGORITHM = "HS256"
 
 pwd_context = CryptContext(schemes=["bcrypt"])
 
+# bcrypt releases the GIL, so a small thread pool keeps hashing off the event loop
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", "4"))
+_hash_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="bcrypt")
+_hash_slots = None
+_hash_stats = {"waiting": 0, "running": 0, "completed": 0, "peak_waiting": 0}
+
 def hash_password(password):
     return pwd_context.hash(password)
 
 def verify_password(password, hashed):
     return pwd_context.verify(password, hashed)
 
+async def _run_in_hash_pool(func, *args):
+    global _hash_slots
+    if _hash_slots is None:
+        _hash_slots = asyncio.Semaphore(HASH_WORKERS)
+    
+    _hash_stats["waiting"] += 1
+    if _hash_slots.locked():
+        _hash_stats["peak_waiting"] = max(_hash_stats["peak_waiting"], _hash_stats["waiting"])
+    async with _hash_slots:
+        _hash_stats["waiting"] -= 1
+        _hash_stats["running"] += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(_hash_executor, func, *args)
+        finally:
+            _hash_stats["running"] -= 1
+            _hash_stats["completed"] += 1
+
+async def hash_password_async(password):
+    """Hash a password without blocking the event loop"""
+    return await _run_in_hash_pool(hash_password, password)
+
+async def verify_password_async(password, hashed):
+    """Verify a password without blocking the event loop"""
+    return await _run_in_hash_pool(verify_password, password, hashed)
+
+def hashing_stats():
+    """Queue depth and throughput counters for the password hashing pool"""
+    return {"workers": HASH_WORKERS, **_hash_stats}
+
+# Verified token payloads, keyed by token digest and kept until the token expires
+_token_cache = LRUCache(maxsize=int(os.getenv("TOKEN_CACHE_SIZE", "10000")))
+
+def decode_token(token):
+    """Decode and verify a JWT, reusing earlier verifications of the same token"""
+    key = hashlib.sha256(token.encode()).hexdigest()
+    payload = _token_cache.get(key)
+    if payload is not None:
+        return payload
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    exp = payload.get("exp")
+    if exp is not None:
+        _token_cache.set(key, payload, ttl=exp - time.time())
+    return payload
+
+def token_cache_stats():
+    return _token_cache.stats()
+
 def create_token(data):
     data["exp"] = datetime.utcnow() + timedelta(hours=2)
     return jwt.encode(data, SECRET_KEY, algorithm=ALGORITHM)
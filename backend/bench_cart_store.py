@@ -0,0 +1,44 @@
+"""Cart write/add/read latency for the line and document layouts.
+
+    python bench_cart_store.py [users] [lines]
+"""
+import asyncio
+import sys
+import time
+from bson import ObjectId
+from bench_support import percentiles, scratch_database
+from cart_store import LineCartStore, DocumentCartStore
+
+async def latency_benchmark(store, users: int = 200, lines: int = 20) -> dict:
+    """Time bulk writes and full-cart reads for one store over many users"""
+    async def timed(make):
+        timings = []
+        async def one(i):
+            started = time.perf_counter()
+            await make(i)
+            timings.append(time.perf_counter() - started)
+        await asyncio.gather(*[one(i) for i in range(users)])
+        return percentiles(timings)
+    
+    cart_lines = {str(ObjectId()): 1 + n % 3 for n in range(lines)}
+    email = "bench{}@example.com".format
+    return {
+        "layout": type(store).__name__,
+        "users": users,
+        "lines": lines,
+        "write": await timed(lambda i: store.put_lines(email(i), cart_lines, replace=True)),
+        "add": await timed(lambda i: store.add_line(email(i), str(ObjectId()), 1)),
+        "read": await timed(lambda i: store.get_lines(email(i)))
+    }
+
+async def main(users: int, lines: int):
+    from database import client
+    async with scratch_database(client, "ecommerce_cart_bench") as scratch:
+        await scratch.cart.create_index([("user_email", 1), ("product_id", 1)], unique=True)
+        for store in (LineCartStore(scratch.cart), DocumentCartStore(scratch.carts)):
+            print(await latency_benchmark(store, users, lines))
+
+if __name__ == "__main__":
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    lines = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    asyncio.run(main(users, lines))
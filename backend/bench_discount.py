@@ -0,0 +1,45 @@
+"""Discount n prices per item vs in one batch call (C++ engine and NumPy paths).
+
+    python bench_discount.py [n]
+"""
+import sys
+import time
+import numpy as np
+import discount_engine
+from discount_engine import apply_discount, apply_discount_many, _apply_discount_many_numpy
+
+def benchmark(n: int = 100000, rounds: int = 5) -> dict:
+    """Best-of-rounds time for each path, and whether their results agree"""
+    rng = np.random.default_rng(0)
+    prices = rng.uniform(1, 100000, n).round(2)
+    percents = rng.integers(0, 80, n).astype(np.int32)
+    price_list, percent_list = prices.tolist(), percents.tolist()
+    out = np.empty_like(prices)
+
+    def best(run):
+        times = []
+        for _ in range(rounds):
+            started = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - started)
+        return min(times)
+
+    per_item = best(lambda: [apply_discount(p, d) for p, d in zip(price_list, percent_list)])
+    batch = best(lambda: apply_discount_many(prices, percents, out))
+    numpy_batch = best(lambda: _apply_discount_many_numpy(prices, percents, out))
+    expected = np.array([apply_discount(p, d) for p, d in zip(price_list, percent_list)])
+    engine = discount_engine.discount
+    return {
+        "items": n,
+        "cpp_engine": bool(engine and hasattr(engine, "applyDiscountBatch")),
+        "per_item_ms": round(per_item * 1000, 2),
+        "batch_ms": round(batch * 1000, 2),
+        "numpy_batch_ms": round(numpy_batch * 1000, 2),
+        "batch_speedup": round(per_item / batch, 1),
+        "numpy_speedup": round(per_item / numpy_batch, 1),
+        "results_match": bool(np.allclose(apply_discount_many(prices, percents), expected))
+    }
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    print(benchmark(count))
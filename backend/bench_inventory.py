@@ -0,0 +1,57 @@
+"""Hot-SKU contention check: many concurrent single-unit checkouts against one product.
+
+    python bench_inventory.py [buyers] [stock]
+
+Fails unless exactly min(buyers, stock) holds are granted with no oversell.
+"""
+import asyncio
+import sys
+import time
+from bson import ObjectId
+from bench_support import percentiles, scratch_database
+from inventory import reserve_stock
+
+async def contention_benchmark(products_collection, reservations_collection,
+                               buyers: int = 300, stock: int = 50) -> dict:
+    product_id = ObjectId()
+    await products_collection.insert_one({"_id": product_id, "stock": stock, "is_active": True})
+    latencies = []
+    
+    async def buy():
+        started = time.perf_counter()
+        short = await reserve_stock(
+            str(ObjectId()), [{"product_id": str(product_id), "quantity": 1}],
+            products_collection, reservations_collection
+        )
+        latencies.append(time.perf_counter() - started)
+        return not short
+    
+    started = time.perf_counter()
+    results = await asyncio.gather(*[buy() for _ in range(buyers)])
+    elapsed = time.perf_counter() - started
+    remaining = (await products_collection.find_one({"_id": product_id}))["stock"]
+    return {
+        "buyers": buyers,
+        "stock": stock,
+        "reserved": sum(results),
+        "remaining_stock": remaining,
+        "seconds": round(elapsed, 3),
+        "checkouts_per_second": round(buyers / elapsed, 1),
+        **percentiles(latencies)
+    }
+
+async def main(buyers: int, stock: int) -> dict:
+    from database import client
+    async with scratch_database(client, "ecommerce_inventory_bench") as scratch:
+        return await contention_benchmark(scratch.products, scratch.stock_reservations, buyers, stock)
+
+if __name__ == "__main__":
+    buyers = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    stock = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    result = asyncio.run(main(buyers, stock))
+    print(result)
+    expected = min(buyers, stock)
+    if result["reserved"] != expected or result["remaining_stock"] != stock - expected:
+        print(f"[FAIL] expected {expected} reservations and {stock - expected} units left")
+        sys.exit(1)
+    print(f"[OK] {buyers} buyers, {expected} reserved, no oversell")
@@ -0,0 +1,61 @@
+"""Round trips to hydrate one cart: per-line find_one vs load_products.
+
+    python bench_loaders.py [cart_lines]
+"""
+import asyncio
+import sys
+import time
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+from bench_support import scratch_database
+from database import MONGO_URL
+from loaders import load_products
+
+class CommandCounter(monitoring.CommandListener):
+    count = 0
+    def started(self, event):
+        if event.command_name in ("find", "getMore", "aggregate"):
+            self.count += 1
+    def succeeded(self, event):
+        pass
+    def failed(self, event):
+        pass
+
+async def round_trip_benchmark(database, command_counter, lines: int = 40) -> dict:
+    """Round trips and time to hydrate one cart of `lines` products"""
+    products_collection = database.products
+    ids = [ObjectId() for _ in range(lines)]
+    await products_collection.insert_many([
+        {"_id": oid, "name": f"Product {n}", "price": 100.0 + n, "is_active": True}
+        for n, oid in enumerate(ids)
+    ])
+    cart_lines = [{"product_id": str(oid), "quantity": 1} for oid in ids]
+    
+    async def per_line():
+        return [await products_collection.find_one({"_id": ObjectId(line["product_id"])})
+                for line in cart_lines]
+    
+    async def batched():
+        return await load_products([line["product_id"] for line in cart_lines], products_collection)
+    
+    result = {"lines": lines}
+    for name, hydrate in (("per_line_find_one", per_line), ("load_products", batched)):
+        command_counter.count = 0
+        started = time.perf_counter()
+        await hydrate()
+        result[name] = {
+            "round_trips": command_counter.count,
+            "ms": round((time.perf_counter() - started) * 1000, 2)
+        }
+    return result
+
+async def main(lines: int) -> dict:
+    counter = CommandCounter()
+    client = AsyncIOMotorClient(MONGO_URL, event_listeners=[counter])
+    async with scratch_database(client, "ecommerce_loader_bench") as scratch:
+        return await round_trip_benchmark(scratch, counter, lines)
+
+if __name__ == "__main__":
+    lines = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    print(asyncio.run(main(lines)))
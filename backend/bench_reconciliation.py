@@ -0,0 +1,58 @@
+"""Payment reconciliation throughput against synthetic gateway events.
+
+    python bench_reconciliation.py [events]
+
+Every order gets a processing and a succeeded event, each delivered twice.
+"""
+import asyncio
+import sys
+import time
+from datetime import datetime
+from bson import ObjectId
+from bench_support import scratch_database
+from indexes import INDEX_PLAN
+from reconciliation import PaymentReconciler, confirmation_event, RECONCILE_BATCH_SIZE
+
+async def benchmark(database, events: int = 20000, batch_size: int = RECONCILE_BATCH_SIZE) -> dict:
+    order_ids = [ObjectId() for _ in range(events // 2)]
+    await database.orders.insert_many([
+        {"_id": oid, "user_email": "bench@example.com", "items": [], "total": 100.0,
+         "payment_status": "Pending", "created_at": datetime.now()}
+        for oid in order_ids
+    ])
+    for name in ("payment_events", "payments"):
+        await database[name].create_indexes(INDEX_PLAN[name])
+
+    reconciler = PaymentReconciler(
+        database.payment_events, database.payments, database.orders, database.products,
+        database.stock_reservations, database.sales_rollups, batch_size
+    )
+    log = []
+    for i, oid in enumerate(order_ids):
+        for status in ("processing", "succeeded"):
+            log.append(confirmation_event(f"pi_bench_{i}", str(oid), "bench@example.com",
+                                          {"status": status, "amount": 100.0}))
+    started = time.perf_counter()
+    for event in log + log:
+        await reconciler.record(event)
+    ingest_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    processed = await reconciler.drain()
+    seconds = time.perf_counter() - started
+    return {
+        "events": processed,
+        "duplicates_dropped": reconciler.duplicates,
+        "ingest_events_per_second": round(len(log) * 2 / ingest_seconds, 1),
+        "events_per_second": round(processed / seconds, 1),
+        "orders_paid": await database.orders.count_documents({"payment_status": "Completed"})
+    }
+
+async def main(events: int) -> dict:
+    from database import client
+    async with scratch_database(client, "ecommerce_reconcile_bench") as scratch:
+        return await benchmark(scratch, events)
+
+if __name__ == "__main__":
+    events = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    print(asyncio.run(main(events)))
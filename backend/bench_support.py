@@ -0,0 +1,17 @@
+"""Helpers shared by the standalone bench_*/check_* scripts and loadtest.py."""
+from contextlib import asynccontextmanager
+
+def percentiles(samples: list) -> dict:
+    """p50/p99 of durations in seconds, reported in milliseconds"""
+    samples = sorted(samples)
+    pick = lambda q: samples[min(len(samples) - 1, int(len(samples) * q))]
+    return {"p50_ms": round(pick(0.5) * 1000, 2), "p99_ms": round(pick(0.99) * 1000, 2)}
+
+@asynccontextmanager
+async def scratch_database(client, name: str):
+    """A freshly dropped database, dropped again on exit"""
+    await client.drop_database(name)
+    try:
+        yield client[name]
+    finally:
+        await client.drop_database(name)
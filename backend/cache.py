@@ -0,0 +1,164 @@
+from collections import OrderedDict
+from typing import Any, Optional
+import hashlib
+import json
+import os
+import time
+
+class LRUCache:
+    """In-process LRU cache with per-entry expiry and hit/miss counters"""
+    
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key, default=None) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.time():
+            del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+    
+    def set(self, key, value, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl if ttl is not None else None
+        self._data[key] = (value, expires_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+    
+    def delete(self, key):
+        self._data.pop(key, None)
+    
+    def clear(self):
+        self._data.clear()
+    
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+
+class MemoryBackend:
+    """Response cache storage inside the API process"""
+    
+    def __init__(self, maxsize: int = 4096):
+        self._entries = LRUCache(maxsize=maxsize)
+        self._generations = {}
+    
+    async def get(self, key):
+        return self._entries.get(key)
+    
+    async def set(self, key, value, ttl: float):
+        self._entries.set(key, value, ttl=ttl)
+    
+    async def generation(self, namespace: str) -> int:
+        return self._generations.get(namespace, 0)
+    
+    async def bump_generation(self, namespace: str):
+        self._generations[namespace] = self._generations.get(namespace, 0) + 1
+
+class RedisBackend:
+    """Response cache storage shared through a Redis compatible server"""
+    
+    def __init__(self, url: str):
+        self._redis = aioredis.from_url(url)
+    
+    async def get(self, key):
+        raw = await self._redis.get(key)
+        return json.loads(raw) if raw else None
+    
+    async def set(self, key, value, ttl: float):
+        await self._redis.set(key, json.dumps(value), ex=max(1, int(ttl)))
+    
+    async def generation(self, namespace: str) -> int:
+        return int(await self._redis.get(f"gen:{namespace}") or 0)
+    
+    async def bump_generation(self, namespace: str):
+        await self._redis.incr(f"gen:{namespace}")
+
+class ResponseCache:
+    """Caches JSON response bodies keyed by normalized request parameters.
+    
+    Invalidation bumps a per-namespace generation number that is part of every
+    key, so stale entries are never read again and simply age out.
+    """
+    
+    def __init__(self, backend, ttl: float = 60):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+    
+    @staticmethod
+    def _digest(value) -> str:
+        raw = json.dumps(value, sort_keys=True, separators=(",", ":"), default=str)
+        return hashlib.sha1(raw.encode()).hexdigest()
+    
+    async def key(self, namespace: str, params: dict) -> str:
+        """Cache key at the current generation.
+        
+        Resolve it once before computing a response and use it for both get
+        and set, so a body computed across an invalidation is stored under
+        the old generation and never served.
+        """
+        generation = await self.backend.generation(namespace)
+        normalized = {k: v for k, v in params.items() if v is not None}
+        return f"{namespace}:{generation}:{self._digest(normalized)}"
+    
+    async def get(self, key: str) -> Optional[dict]:
+        entry = await self.backend.get(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+    
+    async def set(self, key: str, body, headers: dict = None) -> dict:
+        entry = {"etag": f'"{self._digest(body)}"', "body": body, "headers": headers or {}}
+        await self.backend.set(key, entry, self.ttl)
+        return entry
+    
+    async def generation(self, namespace: str) -> int:
+        return await self.backend.generation(namespace)
+    
+    async def invalidate(self, namespace: str):
+        await self.backend.bump_generation(namespace)
+    
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "not_modified": self.not_modified,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+def create_response_cache(ttl: float = 60) -> ResponseCache:
+    """Build a ResponseCache from CACHE_BACKEND (memory or redis) and REDIS_URL"""
+    if os.getenv("CACHE_BACKEND", "memory") == "redis":
+        if aioredis is not None:
+            return ResponseCache(RedisBackend(os.getenv("REDIS_URL", "redis://localhost:6379/0")), ttl)
+        print("Warning: redis package not installed, using in-process response cache")
+    return ResponseCache(MemoryBackend(), ttl)
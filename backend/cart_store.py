@@ -0,0 +1,189 @@
+from datetime import datetime
+from bson import ObjectId
+from pymongo import UpdateOne, ReplaceOne
+from pymongo.errors import DuplicateKeyError
+import os
+
+class LineCartStore:
+    """One document per (user, product) in the cart collection"""
+    
+    def __init__(self, collection):
+        self.collection = collection
+    
+    async def get_lines(self, user_email: str) -> list:
+        return await self.collection.find({"user_email": user_email}).to_list(None)
+    
+    async def add_line(self, user_email: str, product_id: str, quantity: int):
+        await self.collection.update_one(
+            {"user_email": user_email, "product_id": product_id},
+            {"$set": {
+                "user_email": user_email,
+                "product_id": product_id,
+                "quantity": quantity,
+                "added_at": datetime.now()
+            }},
+            upsert=True
+        )
+    
+    async def put_lines(self, user_email: str, lines: dict, replace: bool):
+        """Set quantities for many products at once; quantity 0 removes a line.
+        
+        Not atomic in this layout: upserts and the removal of dropped lines
+        are two writes, so a concurrent reader may briefly see the union of
+        old and new lines (never an empty cart). Use CART_LAYOUT=document
+        when PUT /cart must be a single atomic update.
+        """
+        now = datetime.now()
+        requests = [
+            UpdateOne(
+                {"user_email": user_email, "product_id": product_id},
+                {"$set": {"quantity": quantity}, "$setOnInsert": {"added_at": now}},
+                upsert=True
+            )
+            for product_id, quantity in lines.items() if quantity > 0
+        ]
+        if requests:
+            await self.collection.bulk_write(requests, ordered=False)
+        if replace:
+            keep = [pid for pid, quantity in lines.items() if quantity > 0]
+            await self.collection.delete_many({"user_email": user_email, "product_id": {"$nin": keep}})
+        else:
+            removed = [pid for pid, quantity in lines.items() if quantity <= 0]
+            if removed:
+                await self.collection.delete_many({"user_email": user_email, "product_id": {"$in": removed}})
+    
+    async def remove_line(self, user_email: str, line_id: str) -> bool:
+        result = await self.collection.delete_one({"_id": ObjectId(line_id), "user_email": user_email})
+        return result.deleted_count > 0
+    
+    async def clear(self, user_email: str):
+        await self.collection.delete_many({"user_email": user_email})
+
+class DocumentCartStore:
+    """One document per user with the lines embedded, keyed by email"""
+    
+    MAX_RETRIES = 5
+    
+    def __init__(self, collection):
+        self.collection = collection
+    
+    def _line(self, product_id: str, quantity: int, added_at=None) -> dict:
+        return {
+            "_id": ObjectId(),
+            "product_id": product_id,
+            "quantity": quantity,
+            "added_at": added_at or datetime.now()
+        }
+    
+    async def get_lines(self, user_email: str) -> list:
+        doc = await self.collection.find_one({"_id": user_email}, {"items": 1})
+        return doc.get("items", []) if doc else []
+    
+    async def add_line(self, user_email: str, product_id: str, quantity: int):
+        now = datetime.now()
+        result = await self.collection.update_one(
+            {"_id": user_email, "items.product_id": product_id},
+            {"$set": {"items.$.quantity": quantity, "updated_at": now}, "$inc": {"version": 1}}
+        )
+        if result.matched_count:
+            return
+        try:
+            await self.collection.update_one(
+                {"_id": user_email, "items.product_id": {"$ne": product_id}},
+                {
+                    "$push": {"items": self._line(product_id, quantity, now)},
+                    "$set": {"updated_at": now},
+                    "$inc": {"version": 1}
+                },
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # Another request added the same product first
+            await self.add_line(user_email, product_id, quantity)
+    
+    async def put_lines(self, user_email: str, lines: dict, replace: bool):
+        """Replace or merge many lines in one conditional update, retrying on a concurrent write"""
+        for _ in range(self.MAX_RETRIES):
+            doc = await self.collection.find_one({"_id": user_email}) or {"items": [], "version": 0}
+            previous = {item["product_id"]: item for item in doc["items"]}
+            current = {} if replace else dict(previous)
+            for product_id, quantity in lines.items():
+                if quantity <= 0:
+                    current.pop(product_id, None)
+                elif product_id in previous:
+                    # Keep the line id stable so clients can still address it
+                    current[product_id] = {**previous[product_id], "quantity": quantity}
+                else:
+                    current[product_id] = self._line(product_id, quantity)
+            try:
+                result = await self.collection.update_one(
+                    {"_id": user_email, "version": doc["version"]},
+                    {"$set": {"items": list(current.values()), "updated_at": datetime.now()},
+                     "$inc": {"version": 1}},
+                    upsert=doc["version"] == 0
+                )
+            except DuplicateKeyError:
+                continue
+            if result.matched_count or result.upserted_id is not None:
+                return
+        raise RuntimeError("Cart was modified concurrently, please retry")
+    
+    async def remove_line(self, user_email: str, line_id: str) -> bool:
+        result = await self.collection.update_one(
+            {"_id": user_email, "items._id": ObjectId(line_id)},
+            {"$pull": {"items": {"_id": ObjectId(line_id)}}, "$inc": {"version": 1}}
+        )
+        return result.modified_count > 0
+    
+    async def clear(self, user_email: str):
+        await self.collection.delete_one({"_id": user_email})
+
+def create_cart_store(lines_collection, documents_collection):
+    """Cart store for the CART_LAYOUT setting: lines (default) or document"""
+    if os.getenv("CART_LAYOUT", "lines") == "document":
+        return DocumentCartStore(documents_collection)
+    return LineCartStore(lines_collection)
+
+async def migrate_to_documents(lines_collection, documents_collection, batch_size: int = 500) -> int:
+    """Copy every user's cart lines into the single-document layout.
+    
+    Source lines are left in place so the switch can be rolled back.
+    """
+    pipeline = [
+        {"$sort": {"added_at": 1}},
+        {"$group": {"_id": "$user_email", "items": {"$push": {
+            "_id": "$_id",
+            "product_id": "$product_id",
+            "quantity": "$quantity",
+            "added_at": "$added_at"
+        }}}}
+    ]
+    migrated = 0
+    requests = []
+    async for group in lines_collection.aggregate(pipeline, allowDiskUse=True):
+        requests.append(ReplaceOne(
+            {"_id": group["_id"]},
+            {"items": group["items"], "version": 1, "updated_at": datetime.now()},
+            upsert=True
+        ))
+        if len(requests) >= batch_size:
+            await documents_collection.bulk_write(requests, ordered=False)
+            migrated += len(requests)
+            requests = []
+    if requests:
+        await documents_collection.bulk_write(requests, ordered=False)
+        migrated += len(requests)
+    return migrated
+
+if __name__ == "__main__":
+    import asyncio
+    import sys
+    from database import cart, carts
+    
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if command == "migrate":
+        count = asyncio.run(migrate_to_documents(cart, carts))
+        print(f"[OK] Migrated carts for {count} users; set CART_LAYOUT=document to use them")
+    else:
+        print("Usage: python cart_store.py migrate")
+        sys.exit(1)
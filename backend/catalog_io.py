@@ -0,0 +1,224 @@
+import csv
+import io
+import json
+from collections import deque
+from datetime import datetime
+from bson import ObjectId
+from pydantic import ValidationError
+from pymongo.errors import BulkWriteError
+from schemas import ProductSchema
+
+IMPORT_BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+# Longest CSV record buffered while a quoted field is open; longer ones are reported as malformed
+MAX_CSV_RECORD_CHARS = 1024 * 1024
+EXPORT_FIELDS = list(ProductSchema.__fields__.keys())
+# Fields written to CSV as JSON text; every other column is a plain string
+CSV_JSON_FIELDS = {"images", "specifications"}
+
+def json_default(value):
+    """JSON encoder hook for Mongo types"""
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+async def iter_lines(upload, chunk_size: int = 64 * 1024):
+    """Yield decoded lines from an UploadFile without reading it all into memory"""
+    buffer = b""
+    while True:
+        chunk = await upload.read(chunk_size)
+        if not chunk:
+            break
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8").rstrip("\r")
+    if buffer:
+        yield buffer.decode("utf-8").rstrip("\r")
+
+class _LineFeed:
+    """Iterator the csv reader pulls from; refilled as the upload is read"""
+    
+    def __init__(self):
+        self.lines = deque()
+    
+    def __iter__(self):
+        return self
+    
+    def __next__(self):
+        if not self.lines:
+            raise StopIteration
+        return self.lines.popleft()
+
+def _in_quoted_field(line: str, quoted: bool) -> bool:
+    """Whether a CSV record is still inside a quoted field after this line.
+    
+    Follows csv.reader: a quote opens a field only as its first character,
+    and "" inside a quoted field is an escaped quote.
+    """
+    field_start = not quoted
+    i = 0
+    while i < len(line):
+        char = line[i]
+        if quoted:
+            if char == '"':
+                if line[i + 1:i + 2] == '"':
+                    i += 2
+                    continue
+                quoted = False
+        elif char == '"' and field_start:
+            quoted = True
+        field_start = not quoted and char == ","
+        i += 1
+    return quoted
+
+async def iter_csv_records(upload, max_record_chars: int = MAX_CSV_RECORD_CHARS):
+    """Yield parsed CSV records (or csv.Error) with one reader over the line stream.
+    
+    Lines are handed to the reader once no quoted field is left open, so a
+    quoted field may span lines, as export_products writes for multi-line text.
+    A record still open after max_record_chars is dropped and parsing resumes
+    at the next line.
+    """
+    feed = _LineFeed()
+    reader = csv.reader(feed)
+    quoted = False
+    record_chars = 0
+    async for line in iter_lines(upload):
+        if not feed.lines and not line.strip():
+            continue
+        feed.lines.append(line + "\n")
+        record_chars += len(line) + 1
+        quoted = _in_quoted_field(line, quoted)
+        if quoted:
+            if record_chars > max_record_chars:
+                feed.lines.clear()
+                quoted = False
+                record_chars = 0
+                yield csv.Error(f"Record exceeds {max_record_chars} characters (unterminated quoted field?)")
+            continue
+        record_chars = 0
+        try:
+            yield next(reader)
+        except csv.Error as e:
+            feed.lines.clear()
+            yield e
+    if feed.lines:
+        yield csv.Error("Unterminated quoted field")
+
+def _parse_csv_row(header: list, values: list) -> dict:
+    row = {}
+    for key, value in zip(header, values):
+        if value == "":
+            continue
+        if key in CSV_JSON_FIELDS:
+            value = json.loads(value)
+        row[key] = value
+    return row
+
+async def iter_product_rows(upload, file_format: str):
+    """Yield (row_number, raw_dict or exception) for each record in an NDJSON or CSV upload"""
+    row_number = 0
+    if file_format == "csv":
+        header = None
+        async for record in iter_csv_records(upload):
+            if header is None and not isinstance(record, Exception):
+                header = record
+                continue
+            row_number += 1
+            try:
+                if isinstance(record, Exception):
+                    raise ValueError(str(record))
+                yield row_number, _parse_csv_row(header, record)
+            except ValueError as e:
+                yield row_number, e
+        return
+    
+    async for line in iter_lines(upload):
+        if not line.strip():
+            continue
+        row_number += 1
+        try:
+            yield row_number, json.loads(line)
+        except ValueError as e:
+            yield row_number, e
+
+async def import_products(upload, file_format: str, products_collection,
+                          batch_size: int = IMPORT_BATCH_SIZE, after_batch=None) -> dict:
+    """Validate and insert products from an upload in unordered batches.
+    
+    after_batch, if given, is awaited with each written batch.
+    """
+    inserted = 0
+    failed = 0
+    errors = []
+    
+    def report(row_number, message):
+        nonlocal failed
+        failed += 1
+        if len(errors) < MAX_REPORTED_ERRORS:
+            errors.append({"row": row_number, "error": message})
+    
+    async def flush(batch, row_numbers):
+        nonlocal inserted
+        if not batch:
+            return
+        try:
+            result = await products_collection.insert_many(batch, ordered=False)
+            inserted += len(result.inserted_ids)
+        except BulkWriteError as e:
+            write_errors = e.details.get("writeErrors", [])
+            inserted += len(batch) - len(write_errors)
+            for err in write_errors:
+                report(row_numbers[err["index"]], err.get("errmsg", "Write failed"))
+        if after_batch:
+            await after_batch(batch)
+    
+    batch = []
+    row_numbers = []
+    async for row_number, row in iter_product_rows(upload, file_format):
+        if isinstance(row, Exception):
+            report(row_number, f"Malformed record: {row}")
+            continue
+        try:
+            product_dict = ProductSchema(**row).dict()
+        except ValidationError as e:
+            report(row_number, str(e))
+            continue
+        product_dict["created_at"] = datetime.now()
+        batch.append(product_dict)
+        row_numbers.append(row_number)
+        if len(batch) >= batch_size:
+            await flush(batch, row_numbers)
+            batch, row_numbers = [], []
+    await flush(batch, row_numbers)
+    
+    return {"inserted": inserted, "failed": failed, "errors": errors}
+
+async def export_products(cursor, file_format: str):
+    """Stream products from a cursor as NDJSON lines or CSV rows"""
+    if file_format == "csv":
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerow(["_id"] + EXPORT_FIELDS)
+        async for p in cursor:
+            row = [str(p["_id"])]
+            for field in EXPORT_FIELDS:
+                value = p.get(field)
+                if isinstance(value, (list, dict)):
+                    value = json.dumps(value, default=json_default)
+                row.append("" if value is None else value)
+            writer.writerow(row)
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate(0)
+    else:
+        async for line in iter_ndjson(cursor):
+            yield line
+
+async def iter_ndjson(cursor):
+    """Serialize documents from a cursor as newline delimited JSON"""
+    async for doc in cursor:
+        yield json.dumps(doc, default=json_default) + "\n"
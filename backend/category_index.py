@@ -0,0 +1,89 @@
+from datetime import datetime
+from typing import Iterable
+from pymongo import ReplaceOne, DeleteOne
+
+def _stats_pipeline(match: dict) -> list:
+    return [
+        {"$match": {"is_active": True, **match}},
+        {"$group": {
+            "_id": "$category",
+            "product_count": {"$sum": 1},
+            "min_price": {"$min": "$price"},
+            "max_price": {"$max": "$price"}
+        }}
+    ]
+
+def _category_doc(stats: dict) -> dict:
+    return {
+        "_id": stats["_id"],
+        "name": stats["_id"],
+        "product_count": stats["product_count"],
+        "min_price": stats["min_price"],
+        "max_price": stats["max_price"],
+        "updated_at": datetime.now()
+    }
+
+async def record_product_added(product: dict, categories_collection):
+    """Fold a newly created active product into its category entry"""
+    if not product.get("is_active", True):
+        return
+    await categories_collection.update_one(
+        {"_id": product["category"]},
+        {
+            "$inc": {"product_count": 1},
+            "$min": {"min_price": product["price"]},
+            "$max": {"max_price": product["price"]},
+            "$set": {"name": product["category"], "updated_at": datetime.now()}
+        },
+        upsert=True
+    )
+
+async def refresh_categories(names: Iterable[str], products_collection, categories_collection):
+    """Recompute the entries for the given categories after products change.
+    
+    Price ranges can't be decremented in place, so changed categories are
+    re-aggregated; the category index keeps this limited to their products.
+    """
+    names = [n for n in set(names) if n is not None]
+    if not names:
+        return
+    found = {}
+    async for stats in products_collection.aggregate(_stats_pipeline({"category": {"$in": names}})):
+        found[stats["_id"]] = stats
+    requests = []
+    for name in names:
+        if name in found:
+            requests.append(ReplaceOne({"_id": name}, _category_doc(found[name]), upsert=True))
+        else:
+            requests.append(DeleteOne({"_id": name}))
+    await categories_collection.bulk_write(requests, ordered=False)
+
+async def list_categories(categories_collection) -> list:
+    """All categories with product counts and price ranges, by name"""
+    result = []
+    async for category in categories_collection.find({}, {"updated_at": 0}).sort("_id", 1):
+        category.pop("_id")
+        result.append(category)
+    return result
+
+async def rebuild_categories(products_collection, categories_collection) -> int:
+    """Recompute every category entry from the products collection"""
+    requests = []
+    async for stats in products_collection.aggregate(_stats_pipeline({})):
+        if stats["_id"] is not None:
+            requests.append(_category_doc(stats))
+    await categories_collection.delete_many({})
+    if requests:
+        await categories_collection.insert_many(requests)
+    return len(requests)
+
+if __name__ == "__main__":
+    import asyncio
+    import sys
+    from database import products, categories
+    
+    if len(sys.argv) < 2 or sys.argv[1] != "rebuild":
+        print("Usage: python category_index.py rebuild")
+        sys.exit(1)
+    count = asyncio.run(rebuild_categories(products, categories))
+    print(f"[OK] Rebuilt {count} categories")
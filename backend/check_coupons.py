@@ -0,0 +1,49 @@
+"""Concurrent coupon check: many applies against one limited coupon.
+
+    python check_coupons.py [requests] [usage_limit]
+
+Fails unless exactly min(requests, usage_limit) uses are granted.
+"""
+import asyncio
+import os
+import sys
+from bench_support import scratch_database
+from coupon_service import apply_coupon, invalidate_coupon
+
+async def hammer_coupon(coupons_collection, requests: int = 500, usage_limit: int = 50) -> dict:
+    """Fire concurrent apply_coupon calls at a limited coupon"""
+    code = f"HAMMER{os.getpid()}"
+    await coupons_collection.insert_one({
+        "code": code, "discount_type": "percentage", "discount_value": 10,
+        "usage_limit": usage_limit, "used_count": 0, "is_active": True
+    })
+    invalidate_coupon(code)
+    try:
+        results = await asyncio.gather(*[
+            apply_coupon(code, 100.0, coupons_collection) for _ in range(requests)
+        ])
+        coupon = await coupons_collection.find_one({"code": code})
+        return {
+            "requests": requests,
+            "usage_limit": usage_limit,
+            "granted": sum(1 for r in results if r["valid"]),
+            "used_count": coupon["used_count"]
+        }
+    finally:
+        invalidate_coupon(code)
+
+async def main(requests: int, usage_limit: int) -> dict:
+    from database import client
+    async with scratch_database(client, "ecommerce_coupon_hammer") as scratch:
+        return await hammer_coupon(scratch.coupons, requests, usage_limit)
+
+if __name__ == "__main__":
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    usage_limit = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    result = asyncio.run(main(requests, usage_limit))
+    print(result)
+    expected = min(requests, usage_limit)
+    if result["used_count"] != expected or result["granted"] != expected:
+        print(f"[FAIL] expected {expected} uses, got used_count={result['used_count']} granted={result['granted']}")
+        sys.exit(1)
+    print(f"[OK] {requests} concurrent applies granted exactly {expected} uses")
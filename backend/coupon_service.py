@@ -1,43 +1,84 @@
 from datetime import datetime
 from typing import Optional
 from schemas import CouponSchema, CouponApplySchema
+from cache import LRUCache
+import os
 
-async def validate_coupon(coupon_code: str, cart_total: float, coupons_collection) -> dict:
-    """Validate and apply coupon code"""
-    coupon = await coupons_collection.find_one({"code": coupon_code.upper()})
-    
-    if not coupon:
+# Compiled coupon rules keyed by code. Unknown codes are cached as False so
+# repeated lookups of a bad code don't reach the database either.
+COUPON_CACHE_TTL = float(os.getenv("COUPON_CACHE_TTL", "60"))
+_coupon_rules = LRUCache(maxsize=4096, ttl=COUPON_CACHE_TTL)
+
+def _parse_date(value) -> Optional[datetime]:
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(str(value))
+
+def compile_coupon(coupon: dict) -> dict:
+    """Pre-parse a coupon document into the fields validation needs"""
+    return {
+        "id": str(coupon["_id"]),
+        "is_active": coupon.get("is_active", True),
+        "valid_from": _parse_date(coupon.get("valid_from")),
+        "valid_until": _parse_date(coupon.get("valid_until")),
+        "min_purchase": coupon.get("min_purchase"),
+        "max_discount": coupon.get("max_discount"),
+        "usage_limit": coupon.get("usage_limit"),
+        "used_count": coupon.get("used_count", 0),
+        "discount_type": coupon.get("discount_type", "percentage"),
+        "discount_value": coupon.get("discount_value", 0),
+    }
+
+async def get_coupon_rule(coupon_code: str, coupons_collection) -> Optional[dict]:
+    """Return the compiled rule for a code, loading it on a cache miss"""
+    code = coupon_code.upper()
+    rule = _coupon_rules.get(code)
+    if rule is None:
+        coupon = await coupons_collection.find_one({"code": code})
+        rule = compile_coupon(coupon) if coupon else False
+        _coupon_rules.set(code, rule)
+    return rule or None
+
+def invalidate_coupon(coupon_code: str):
+    """Drop a cached rule, e.g. after the coupon is created or edited"""
+    _coupon_rules.delete(coupon_code.upper())
+
+def coupon_cache_stats() -> dict:
+    return _coupon_rules.stats()
+
+def check_coupon_rule(rule: Optional[dict], cart_total: float) -> dict:
+    """Validate a compiled rule against a cart total without touching the database"""
+    if not rule:
         return {"valid": False, "message": "Invalid coupon code"}
     
-    if not coupon.get("is_active", True):
+    if not rule["is_active"]:
         return {"valid": False, "message": "Coupon is not active"}
     
     now = datetime.now()
-    valid_from = coupon.get("valid_from")
-    valid_until = coupon.get("valid_until")
-    
-    if valid_from and datetime.fromisoformat(str(valid_from)) > now:
+    if rule["valid_from"] and rule["valid_from"] > now:
         return {"valid": False, "message": "Coupon not yet valid"}
     
-    if valid_until and datetime.fromisoformat(str(valid_until)) < now:
+    if rule["valid_until"] and rule["valid_until"] < now:
         return {"valid": False, "message": "Coupon has expired"}
     
-    min_purchase = coupon.get("min_purchase")
+    min_purchase = rule["min_purchase"]
     if min_purchase and cart_total < min_purchase:
         return {"valid": False, "message": f"Minimum purchase of ₹{min_purchase} required"}
     
-    usage_limit = coupon.get("usage_limit")
-    used_count = coupon.get("used_count", 0)
-    if usage_limit and used_count >= usage_limit:
+    # used_count here is a snapshot; apply_coupon makes the authoritative check
+    usage_limit = rule["usage_limit"]
+    if usage_limit and rule["used_count"] >= usage_limit:
         return {"valid": False, "message": "Coupon usage limit reached"}
     
     # Calculate discount
-    discount_type = coupon.get("discount_type", "percentage")
-    discount_value = coupon.get("discount_value", 0)
+    discount_type = rule["discount_type"]
+    discount_value = rule["discount_value"]
     
     if discount_type == "percentage":
         discount_amount = (cart_total * discount_value) / 100
-        max_discount = coupon.get("max_discount")
+        max_discount = rule["max_discount"]
         if max_discount and discount_amount > max_discount:
             discount_amount = max_discount
     else:
@@ -51,18 +92,52 @@ async def validate_coupon(coupon_code: str, cart_total: float, coupons_collectio
         "discount_type": discount_type,
         "discount_value": discount_value,
         "final_amount": round(cart_total - discount_amount, 2),
-        "coupon_id": str(coupon["_id"])
+        "coupon_id": rule["id"]
     }
 
+async def validate_coupon(coupon_code: str, cart_total: float, coupons_collection) -> dict:
+    """Validate and apply coupon code"""
+    rule = await get_coupon_rule(coupon_code, coupons_collection)
+    return check_coupon_rule(rule, cart_total)
+
 async def apply_coupon(coupon_code: str, cart_total: float, coupons_collection) -> dict:
-    """Apply coupon and increment usage count"""
+    """Apply coupon and reserve one use.
+
+    The usage limit is re-checked inside the same conditional update that
+    increments used_count, so concurrent orders cannot overshoot it.
+    """
     validation = await validate_coupon(coupon_code, cart_total, coupons_collection)
     
     if validation["valid"]:
-        await coupons_collection.update_one(
-            {"code": coupon_code.upper()},
+        result = await coupons_collection.update_one(
+            {
+                "code": coupon_code.upper(),
+                "is_active": {"$ne": False},
+                "$or": [
+                    {"usage_limit": None},
+                    {"usage_limit": 0},
+                    {"$expr": {"$lt": [{"$ifNull": ["$used_count", 0]}, "$usage_limit"]}}
+                ]
+            },
             {"$inc": {"used_count": 1}}
         )
+        rule = await get_coupon_rule(coupon_code, coupons_collection)
+        if result.modified_count == 0:
+            # Remember the exhaustion so validations stop early without a query
+            if rule and rule["usage_limit"]:
+                rule["used_count"] = rule["usage_limit"]
+            return {"valid": False, "message": "Coupon usage limit reached"}
+        if rule:
+            rule["used_count"] += 1
     
     return validation
 
+async def release_coupon(coupon_code: str, coupons_collection):
+    """Give back a use reserved by apply_coupon when the order is not placed"""
+    await coupons_collection.update_one(
+        {"code": coupon_code.upper(), "used_count": {"$gt": 0}},
+        {"$inc": {"used_count": -1}}
+    )
+    rule = await get_coupon_rule(coupon_code, coupons_collection)
+    if rule and rule["used_count"] > 0:
+        rule["used_count"] -= 1
@@ -0,0 +1,68 @@
+import ctypes
+import os
+import sys
+import numpy as np
+
+# ---------- LOAD C++ DISCOUNT ENGINE ----------
+try:
+    if sys.platform == "win32":
+        dll_path = os.path.join(os.path.dirname(__file__), "..", "cpp-engine", "discount.dll")
+        if os.path.exists(dll_path):
+            discount = ctypes.CDLL(dll_path)
+        else:
+            discount = None
+    else:
+        so_path = os.path.join(os.path.dirname(__file__), "..", "cpp-engine", "discount.so")
+        if os.path.exists(so_path):
+            discount = ctypes.CDLL(so_path)
+        else:
+            discount = None
+    
+    if discount:
+        discount.applyDiscount.restype = ctypes.c_double
+        if hasattr(discount, "applyDiscountBatch"):
+            discount.applyDiscountBatch.restype = None
+            discount.applyDiscountBatch.argtypes = [
+                np.ctypeslib.ndpointer(np.float64, flags="C_CONTIGUOUS"),
+                np.ctypeslib.ndpointer(np.int32, flags="C_CONTIGUOUS"),
+                np.ctypeslib.ndpointer(np.float64, flags="C_CONTIGUOUS,WRITEABLE"),
+                ctypes.c_int
+            ]
+except Exception as e:
+    print(f"Warning: Could not load C++ discount engine: {e}")
+    discount = None
+
+def apply_discount(price, percent):
+    if discount:
+        try:
+            return discount.applyDiscount(ctypes.c_double(price), ctypes.c_int(percent))
+        except:
+            pass
+    if percent < 0 or percent > 70:
+        return price
+    return price - (price * percent / 100.0)
+
+def apply_discount_many(prices, percents, out=None):
+    """Discount a whole array of prices in one call.
+    
+    percents may be a scalar or an array matching prices. Contiguous float64
+    prices are passed to the C++ engine without copying; pass out=prices to
+    reprice in place.
+    """
+    prices = np.ascontiguousarray(prices, dtype=np.float64)
+    percents = np.ascontiguousarray(np.broadcast_to(percents, prices.shape), dtype=np.int32)
+    if out is None:
+        out = np.empty_like(prices)
+    
+    if discount and hasattr(discount, "applyDiscountBatch"):
+        try:
+            discount.applyDiscountBatch(prices, percents, out, prices.size)
+            return out
+        except Exception:
+            pass
+    return _apply_discount_many_numpy(prices, percents, out)
+
+def _apply_discount_many_numpy(prices, percents, out):
+    valid = (percents >= 0) & (percents <= 70)
+    np.copyto(out, np.where(valid, prices - prices * percents / 100.0, prices))
+    return out
@@ -0,0 +1,232 @@
+from pymongo import IndexModel, ASCENDING, DESCENDING, TEXT
+from pymongo.errors import PyMongoError
+from database import db
+
+# Index plan, one entry per query shape the API issues. Names are fixed so
+# reconciliation can match declared indexes against what exists.
+INDEX_PLAN = {
+    "users": [
+        IndexModel([("email", ASCENDING)], name="email_1", unique=True),
+    ],
+    "products": [
+        # Listing / facet filters: is_active equality, category equality, price range
+        IndexModel([("is_active", ASCENDING), ("category", ASCENDING), ("price", ASCENDING)],
+                   name="is_active_1_category_1_price_1"),
+        # Unfiltered listing paged by _id
+        IndexModel([("is_active", ASCENDING), ("_id", ASCENDING)], name="is_active_1__id_1"),
+        # Featured listing; inactive products are never listed, so leave them out
+        IndexModel([("is_featured", ASCENDING), ("_id", ASCENDING)], name="active_is_featured_1__id_1",
+                   partialFilterExpression={"is_active": True}),
+        IndexModel([("category", ASCENDING)], name="category_1"),
+        IndexModel([("name", TEXT), ("description", TEXT)], name="name_text_description_text"),
+    ],
+    "orders": [
+        # A user's orders, newest first
+        IndexModel([("user_email", ASCENDING), ("_id", DESCENDING)], name="user_email_1__id_-1"),
+        IndexModel([("tracking_number", ASCENDING)], name="tracking_number_1"),
+        IndexModel([("status", ASCENDING)], name="status_1"),
+        IndexModel([("created_at", DESCENDING)], name="created_at_-1"),
+    ],
+    "addresses": [
+        IndexModel([("user_email", ASCENDING)], name="user_email_1"),
+    ],
+    "cart": [
+        # add_to_cart upserts on (user_email, product_id); reads by user_email use the prefix
+        IndexModel([("user_email", ASCENDING), ("product_id", ASCENDING)],
+                   name="user_email_1_product_id_1", unique=True),
+    ],
+    "coupons": [
+        IndexModel([("code", ASCENDING)], name="code_1", unique=True),
+        IndexModel([("is_active", ASCENDING), ("_id", ASCENDING)], name="is_active_1__id_1"),
+    ],
+    "payments": [
+        IndexModel([("order_id", ASCENDING)], name="order_id_1"),
+        IndexModel([("created_at", ASCENDING)], name="created_at_1"),
+        IndexModel([("status", ASCENDING), ("created_at", ASCENDING)], name="status_1_created_at_1"),
+        # Reconciliation upserts one record per (intent, order), possibly from several workers
+        IndexModel([("payment_intent_id", ASCENDING), ("order_id", ASCENDING)],
+                   name="payment_intent_id_1_order_id_1", unique=True),
+    ],
+    "payment_events": [
+        # Reconciliation worker reads pending events in arrival order
+        IndexModel([("processed_at", ASCENDING), ("received_at", ASCENDING)],
+                   name="processed_at_1_received_at_1"),
+        # Replays select events by gateway timestamp
+        IndexModel([("created", ASCENDING)], name="created_1"),
+    ],
+    "shipping_trackers": [
+        IndexModel([("tracking_number", ASCENDING)], name="tracking_number_1", unique=True),
+        IndexModel([("order_id", ASCENDING)], name="order_id_1"),
+    ],
+    "shipping_events": [
+        # Append-only tracking log read as "events for a shipment since T"
+        IndexModel([("tracking_number", ASCENDING), ("timestamp", ASCENDING)],
+                   name="tracking_number_1_timestamp_1"),
+    ],
+    "warehouses": [
+        IndexModel([("name", ASCENDING)], name="name_1", unique=True),
+    ],
+    "stock_reservations": [
+        # Expiry sweep for abandoned checkouts
+        IndexModel([("status", ASCENDING), ("expires_at", ASCENDING)], name="status_1_expires_at_1"),
+        IndexModel([("purge_at", ASCENDING)], name="purge_at_1", expireAfterSeconds=0),
+    ],
+    "sales_rollups": [
+        IndexModel([("kind", ASCENDING), ("quantity", DESCENDING)], name="kind_1_quantity_-1"),
+        IndexModel([("kind", ASCENDING), ("key", ASCENDING)], name="kind_1_key_1"),
+    ],
+}
+
+# Indexes superseded by a compound index above
+RETIRED_INDEXES = {
+    "orders": ["user_email_1"],
+    "cart": ["user_email_1"],
+    "products": ["name_1"],
+}
+
+_COMPARED_OPTIONS = ("unique", "sparse", "partialFilterExpression", "expireAfterSeconds")
+
+def _matches(spec: dict, existing: dict) -> bool:
+    is_text = any(direction == TEXT for _, direction in spec["key"].items())
+    if not is_text and list(spec["key"].items()) != [tuple(k) for k in existing["key"]]:
+        return False
+    return all(spec.get(opt) == existing.get(opt) for opt in _COMPARED_OPTIONS)
+
+def _bridge_model(spec: dict):
+    """Stand-in index for a drifted one while it is rebuilt under the same name.
+    
+    Same leading keys with _id appended, so it is a distinct key pattern that
+    still serves the queries the old index served. None for text indexes
+    (one per collection) or keys already ending in _id.
+    """
+    keys = list(spec["key"].items())
+    if any(direction == TEXT for _, direction in keys) or keys[-1][0] == "_id":
+        return None
+    return IndexModel(keys + [("_id", ASCENDING)], name=f"{spec['name']}__bridge")
+
+async def reconcile_collection(collection, models: list, retired: list = ()) -> dict:
+    """Bring one collection's indexes in line with its declared models.
+    
+    Replacements are built before anything is dropped, so the queries an
+    old index served stay indexed while the new one builds.
+    """
+    report = {"created": [], "rebuilt": [], "dropped": [], "errors": []}
+    existing = await collection.index_information()
+    
+    missing = []
+    drifted = []
+    for model in models:
+        spec = model.document
+        name = spec["name"]
+        if name not in existing:
+            missing.append(model)
+        elif not _matches(spec, existing[name]):
+            drifted.append(model)
+    
+    if missing:
+        try:
+            await collection.create_indexes(missing)
+            report["created"] += [m.document["name"] for m in missing]
+        except PyMongoError as e:
+            report["errors"].append(str(e))
+    
+    for model in drifted:
+        name = model.document["name"]
+        bridge = _bridge_model(model.document)
+        try:
+            if bridge:
+                await collection.create_indexes([bridge])
+            await collection.drop_index(name)
+            await collection.create_indexes([model])
+        except PyMongoError as e:
+            # Leave the bridge in place so the queries stay indexed until the next run
+            report["errors"].append(str(e))
+            continue
+        report["rebuilt"].append(name)
+        if bridge:
+            await collection.drop_index(bridge.document["name"])
+    
+    if not report["errors"]:
+        for name in retired:
+            if name in existing:
+                await collection.drop_index(name)
+                report["dropped"].append(name)
+    return report
+
+async def reconcile_indexes(database=db) -> dict:
+    """Idempotently apply INDEX_PLAN to every collection.
+    
+    Safe to run on every startup: unchanged indexes are left alone, so after
+    the first run this is one listIndexes call per collection.
+    """
+    results = {}
+    for collection_name, models in INDEX_PLAN.items():
+        try:
+            results[collection_name] = await reconcile_collection(
+                database[collection_name], models, RETIRED_INDEXES.get(collection_name, [])
+            )
+        except PyMongoError as e:
+            results[collection_name] = {"errors": [str(e)]}
+    return results
+
+# Representative filters/sorts for each endpoint, checked by `python indexes.py explain`
+QUERY_SHAPES = [
+    ("users", {"email": "a@example.com"}, None),
+    ("products", {"is_active": True, "category": "Electronics", "price": {"$gte": 100, "$lte": 500}}, [("_id", 1)]),
+    ("products", {"is_active": True}, [("_id", 1)]),
+    ("products", {"is_active": True, "is_featured": True}, [("_id", 1)]),
+    ("products", {"is_active": True, "$text": {"$search": "phone"}}, None),
+    ("orders", {"user_email": "a@example.com"}, [("_id", -1)]),
+    ("orders", {"tracking_number": "TRK0000000000"}, None),
+    ("orders", {}, [("created_at", -1)]),
+    ("cart", {"user_email": "a@example.com", "product_id": "0"}, None),
+    ("cart", {"user_email": "a@example.com"}, None),
+    ("addresses", {"user_email": "a@example.com"}, None),
+    ("coupons", {"code": "SAVE10"}, None),
+    ("coupons", {"is_active": True}, [("_id", 1)]),
+    ("payments", {"status": "completed"}, None),
+    ("payments", {"created_at": {"$gte": 0}}, None),
+    ("payments", {"payment_intent_id": "pi_0", "order_id": "0"}, None),
+    ("payment_events", {"processed_at": None}, [("received_at", 1)]),
+    ("shipping_trackers", {"tracking_number": "TRK0000000000"}, None),
+    ("shipping_trackers", {"order_id": "0"}, None),
+    ("shipping_events", {"tracking_number": "TRK0000000000", "timestamp": {"$gt": 0}}, [("timestamp", 1)]),
+    ("sales_rollups", {"kind": "product"}, [("quantity", -1)]),
+    ("stock_reservations", {"status": "held", "expires_at": {"$lt": 0}}, None),
+]
+
+def _plan_stages(plan: dict):
+    yield plan.get("stage")
+    for child in plan.get("inputStages", []) + [plan.get("inputStage")]:
+        if child:
+            yield from _plan_stages(child)
+
+async def find_collscans(database=db) -> list:
+    """Explain every QUERY_SHAPES entry and return the ones planned as COLLSCAN"""
+    offenders = []
+    for collection_name, query, sort in QUERY_SHAPES:
+        command = {"find": collection_name, "filter": query}
+        if sort:
+            command["sort"] = dict(sort)
+        explain = await database.command({"explain": command, "verbosity": "queryPlanner"})
+        stages = set(_plan_stages(explain["queryPlanner"]["winningPlan"]))
+        if "COLLSCAN" in stages:
+            offenders.append((collection_name, query, sort))
+    return offenders
+
+if __name__ == "__main__":
+    import asyncio
+    import sys
+    
+    async def main():
+        print(f"[OK] Reconciled indexes: {await reconcile_indexes()}")
+        if len(sys.argv) > 1 and sys.argv[1] == "explain":
+            offenders = await find_collscans()
+            for collection_name, query, sort in offenders:
+                print(f"[COLLSCAN] {collection_name} filter={query} sort={sort}")
+            if offenders:
+                return False
+            print(f"[OK] All {len(QUERY_SHAPES)} query shapes use an index")
+        return True
+    
+    sys.exit(0 if asyncio.run(main()) else 1)
@@ -0,0 +1,165 @@
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import UpdateOne, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+import os
+
+RESERVATION_TTL_SECONDS = int(os.getenv("RESERVATION_TTL_SECONDS", "900"))
+# Finished reservations are kept this long for auditing, then removed by a TTL index
+RESERVATION_RETENTION = timedelta(days=1)
+
+def _merge_items(items) -> dict:
+    """Total quantity per product id across order lines"""
+    quantities = {}
+    for item in items:
+        if item["quantity"] < 1:
+            raise ValueError(f"Invalid quantity for product {item['product_id']}")
+        quantities[item["product_id"]] = quantities.get(item["product_id"], 0) + item["quantity"]
+    return quantities
+
+def _hold_field(order_id: str) -> str:
+    return f"holds.{order_id}"
+
+async def _restore_holds(order_id: str, quantities: dict, products_collection):
+    """Return stock for every line that still carries this order's hold"""
+    hold = _hold_field(order_id)
+    requests = [
+        UpdateOne(
+            {"_id": ObjectId(product_id), hold: {"$exists": True}},
+            {"$inc": {"stock": quantity}, "$unset": {hold: ""}}
+        )
+        for product_id, quantity in quantities.items()
+    ]
+    if requests:
+        await products_collection.bulk_write(requests, ordered=False)
+
+async def reserve_stock(order_id: str, items, products_collection, reservations_collection,
+                        ttl_seconds: int = RESERVATION_TTL_SECONDS) -> list:
+    """Atomically take stock for all order lines, or none of them.
+    
+    Each line is a conditional $inc that only applies while enough stock is
+    left, and tags the product with a hold for this order so a partial
+    reservation can be undone exactly. Returns the product ids that were
+    short; an empty list means everything is reserved. Raises ValueError
+    for a line quantity below 1.
+    """
+    quantities = _merge_items(items)
+    invalid = [pid for pid in quantities if not ObjectId.is_valid(pid)]
+    if invalid:
+        return invalid
+    if not quantities:
+        return []
+    
+    now = datetime.now()
+    # Record the reservation first so the expiry sweep can clean up after a crash.
+    # A released reservation may be taken again; a held or committed one may not.
+    await reservations_collection.replace_one(
+        {"_id": order_id, "status": "released"},
+        {
+            "items": quantities,
+            "status": "held",
+            "created_at": now,
+            "expires_at": now + timedelta(seconds=ttl_seconds)
+        },
+        upsert=True
+    )
+    
+    hold = _hold_field(order_id)
+    requests = [
+        UpdateOne(
+            {"_id": ObjectId(product_id), "is_active": True, "stock": {"$gte": quantity}},
+            {"$inc": {"stock": -quantity}, "$set": {hold: quantity}}
+        )
+        for product_id, quantity in quantities.items()
+    ]
+    result = await products_collection.bulk_write(requests, ordered=False)
+    if result.modified_count == len(requests):
+        return []
+    
+    held = set()
+    async for p in products_collection.find(
+        {"_id": {"$in": [ObjectId(pid) for pid in quantities]}, hold: {"$exists": True}}, {"_id": 1}
+    ):
+        held.add(str(p["_id"]))
+    await release_stock(order_id, products_collection, reservations_collection)
+    return [pid for pid in quantities if pid not in held]
+
+async def _finish_reservation(order_id: str, status: str, reservations_collection):
+    """Move a held reservation to a final status; None if it wasn't held"""
+    return await reservations_collection.find_one_and_update(
+        {"_id": order_id, "status": "held"},
+        {"$set": {"status": status, "purge_at": datetime.now() + RESERVATION_RETENTION}},
+        return_document=ReturnDocument.AFTER
+    )
+
+async def release_stock(order_id: str, products_collection, reservations_collection) -> bool:
+    """Give back held stock, e.g. on payment failure, cancellation or expiry"""
+    reservation = await _finish_reservation(order_id, "released", reservations_collection)
+    if not reservation:
+        return False
+    await _restore_holds(order_id, reservation["items"], products_collection)
+    return True
+
+async def commit_stock(order_id: str, products_collection, reservations_collection) -> bool:
+    """Make a reservation permanent once the order is paid"""
+    reservation = await _finish_reservation(order_id, "committed", reservations_collection)
+    if not reservation:
+        return False
+    hold = _hold_field(order_id)
+    await products_collection.bulk_write([
+        UpdateOne({"_id": ObjectId(product_id)}, {"$unset": {hold: ""}})
+        for product_id in reservation["items"]
+    ], ordered=False)
+    return True
+
+async def settle_paid_stock(order: dict, products_collection, reservations_collection,
+                            orders_collection) -> bool:
+    """Make a paid order's stock permanent; returns False if it had to be flagged.
+    
+    Normally this commits the checkout's hold. If the hold was already
+    released (expiry sweep, cancellation) the stock is reserved again, and
+    when that isn't possible the order is flagged for review rather than
+    fulfilled silently.
+    """
+    order_id = str(order["_id"])
+    if await commit_stock(order_id, products_collection, reservations_collection):
+        return True
+    if await reservations_collection.find_one({"_id": order_id, "status": "committed"}, {"_id": 1}):
+        return True
+    
+    shortfall = []
+    if order.get("status") == "Cancelled":
+        reason = "paid_after_cancellation"
+    else:
+        reason = "stock_unavailable"
+        try:
+            shortfall = await reserve_stock(
+                order_id, order.get("items", []), products_collection, reservations_collection
+            )
+        except DuplicateKeyError:
+            # A concurrent settle re-reserved it first; the stock is held for this order
+            await commit_stock(order_id, products_collection, reservations_collection)
+            return True
+        except ValueError:
+            reason = "invalid_items"
+        else:
+            if not shortfall:
+                await commit_stock(order_id, products_collection, reservations_collection)
+                return True
+    
+    await orders_collection.update_one(
+        {"_id": order["_id"]},
+        {"$set": {"review_reason": reason, "stock_shortfall": shortfall, "flagged_at": datetime.now()}}
+    )
+    print(f"Warning: paid order {order_id} flagged for review ({reason})")
+    return False
+
+async def expire_reservations(products_collection, reservations_collection) -> list:
+    """Release every hold past its expiry; returns the affected order ids"""
+    expired = []
+    async for reservation in reservations_collection.find(
+        {"status": "held", "expires_at": {"$lt": datetime.now()}}, {"_id": 1}
+    ):
+        if await release_stock(reservation["_id"], products_collection, reservations_collection):
+            expired.append(reservation["_id"])
+    return expired
@@ -0,0 +1,17 @@
+from typing import Iterable, Optional
+from bson import ObjectId
+
+async def load_products(product_ids: Iterable[str], products_collection,
+                        projection: Optional[dict] = None) -> dict:
+    """Fetch many products in a single $in query, keyed by string id"""
+    object_ids = []
+    for product_id in set(product_ids):
+        if ObjectId.is_valid(product_id):
+            object_ids.append(ObjectId(product_id))
+    if not object_ids:
+        return {}
+    
+    result = {}
+    async for product in products_collection.find({"_id": {"$in": object_ids}}, projection):
+        result[str(product["_id"])] = product
+    return result
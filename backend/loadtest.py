@@ -0,0 +1,153 @@
+"""HTTP load checks against a running backend.
+
+    python loadtest.py login-storm [base_url] [logins] [probes]
+    python loadtest.py tracking-batch [base_url] [batches] [batch_size] [concurrency]
+
+LOADTEST_EMAIL / LOADTEST_PASSWORD name an existing account to log in with;
+tracking-batch needs an admin account (LOADTEST_ADMIN_EMAIL / _PASSWORD)
+and pings the shipments returned by /admin/orders/tracking.
+"""
+import asyncio
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+import httpx
+from bench_support import percentiles
+
+BASE_URL = os.getenv("LOADTEST_BASE_URL", "http://localhost:8000")
+LOADTEST_EMAIL = os.getenv("LOADTEST_EMAIL", "loadtest@example.com")
+LOADTEST_PASSWORD = os.getenv("LOADTEST_PASSWORD", "loadtest")
+LOADTEST_ADMIN_EMAIL = os.getenv("LOADTEST_ADMIN_EMAIL", "admin@example.com")
+LOADTEST_ADMIN_PASSWORD = os.getenv("LOADTEST_ADMIN_PASSWORD", "admin")
+# Fail when p99 of the probe endpoint under load exceeds this multiple of its baseline
+MAX_P99_RATIO = float(os.getenv("LOADTEST_MAX_P99_RATIO", "3"))
+PROBE_PATH = "/products/categories/list"
+PROBE_INTERVAL_SECONDS = 0.02
+
+async def probe(client: httpx.AsyncClient, count: int) -> list:
+    """Latency of an endpoint unrelated to login, sampled at a steady rate.
+    
+    Each sample is measured from its scheduled send time, so a stall that
+    delays sending counts against latency instead of being skipped.
+    """
+    latencies = []
+    start = time.perf_counter()
+    for i in range(count):
+        scheduled = start + i * PROBE_INTERVAL_SECONDS
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        response = await client.get(PROBE_PATH)
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - scheduled)
+    return latencies
+
+async def login_storm(base_url: str = BASE_URL, logins: int = 200, probes: int = 200) -> dict:
+    """p50/p99 of the probe endpoint alone, then while `logins` logins run concurrently"""
+    limits = httpx.Limits(max_connections=logins + 10)
+    async with httpx.AsyncClient(base_url=base_url, timeout=60, limits=limits) as client:
+        # The probe endpoint needs a signed-in user
+        response = await client.post(
+            "/login", json={"email": LOADTEST_EMAIL, "password": LOADTEST_PASSWORD}
+        )
+        response.raise_for_status()
+        client.headers["Authorization"] = f"Bearer {response.json()['token']}"
+        await client.get(PROBE_PATH)  # warm the catalog cache
+        baseline = await probe(client, probes)
+
+        async def login():
+            response = await client.post(
+                "/login", json={"email": LOADTEST_EMAIL, "password": LOADTEST_PASSWORD}
+            )
+            return response.status_code == 200
+
+        started = time.perf_counter()
+        storm = asyncio.gather(*[login() for _ in range(logins)])
+        under_load = await probe(client, probes)
+        results = await storm
+        elapsed = time.perf_counter() - started
+
+    return {
+        "logins": logins,
+        "logins_ok": sum(results),
+        "logins_per_second": round(logins / elapsed, 1),
+        "baseline": percentiles(baseline),
+        "during_login_storm": percentiles(under_load)
+    }
+
+async def tracking_batch(base_url: str = BASE_URL, batches: int = 50, batch_size: int = 1000,
+                         concurrency: int = 4) -> dict:
+    """Throughput of POST /track/locations/batch with pings spread over existing shipments"""
+    async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+        response = await client.post(
+            "/login", json={"email": LOADTEST_ADMIN_EMAIL, "password": LOADTEST_ADMIN_PASSWORD}
+        )
+        response.raise_for_status()
+        client.headers["Authorization"] = f"Bearer {response.json()['token']}"
+        response = await client.get("/admin/orders/tracking", params={"limit": 200})
+        response.raise_for_status()
+        tracking_numbers = [t["tracking_number"] for t in response.json()]
+        if not tracking_numbers:
+            raise RuntimeError("No shipments to ping; place some orders first")
+        
+        clock = datetime.now(timezone.utc)
+        def ping(i):
+            return {
+                "tracking_number": random.choice(tracking_numbers),
+                "latitude": random.uniform(8, 35),
+                "longitude": random.uniform(68, 97),
+                "address": "Load test",
+                "timestamp": (clock + timedelta(milliseconds=i)).isoformat(),
+                "status": "In Transit"
+            }
+        payloads = [[ping(b * batch_size + i) for i in range(batch_size)] for b in range(batches)]
+        
+        slots = asyncio.Semaphore(concurrency)
+        latencies = []
+        accepted = 0
+        async def send(payload):
+            nonlocal accepted
+            async with slots:
+                started = time.perf_counter()
+                response = await client.post("/track/locations/batch", json=payload)
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - started)
+                accepted += response.json()["accepted"]
+        
+        started = time.perf_counter()
+        await asyncio.gather(*[send(payload) for payload in payloads])
+        elapsed = time.perf_counter() - started
+    
+    return {
+        "batches": batches,
+        "batch_size": batch_size,
+        "shipments": len(tracking_numbers),
+        "accepted": accepted,
+        "events_per_second": round(accepted / elapsed, 1),
+        "request": percentiles(latencies)
+    }
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if command == "login-storm":
+        base_url = sys.argv[2] if len(sys.argv) > 2 else BASE_URL
+        logins = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+        probes = int(sys.argv[4]) if len(sys.argv) > 4 else 200
+        result = asyncio.run(login_storm(base_url, logins, probes))
+        print(result)
+        ratio = result["during_login_storm"]["p99_ms"] / max(result["baseline"]["p99_ms"], 1.0)
+        if result["logins_ok"] != logins or ratio > MAX_P99_RATIO:
+            print(f"[FAIL] p99 grew {ratio:.1f}x during the login storm ({result['logins_ok']}/{logins} logins ok)")
+            sys.exit(1)
+        print(f"[OK] p99 grew {ratio:.1f}x during {logins} concurrent logins")
+    elif command == "tracking-batch":
+        base_url = sys.argv[2] if len(sys.argv) > 2 else BASE_URL
+        batches = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+        batch_size = int(sys.argv[4]) if len(sys.argv) > 4 else 1000
+        concurrency = int(sys.argv[5]) if len(sys.argv) > 5 else 4
+        print(asyncio.run(tracking_batch(base_url, batches, batch_size, concurrency)))
+    else:
+        print(__doc__)
+        sys.exit(1)
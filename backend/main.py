@@ -1,38 +1,76 @@
-from fastapi import FastAPI, HTTPException, Depends, Header, Query, Body
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, Body, Request, Response, UploadFile, File
+from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from database import (
-    users, products, orders, addresses, cart, coupons, 
-    payments, shipping_trackers, categories, reviews, create_indexes
+    users, products, orders, addresses, cart, carts, coupons, 
+    payments, payment_events, shipping_trackers, categories, reviews, sales_rollups, shipping_events,
+    warehouses, stock_reservations
 )
+from indexes import reconcile_indexes
+from pubsub import TrackingHub
+from pricing import price_cart, price_lines, order_totals, pricing_cache_stats
+from warehouses import load_warehouses, nearest_warehouse
+from cart_store import create_cart_store
+from reconciliation import (
+    PaymentReconciler, verify_signature, confirmation_event, covers_order, ORDER_CURRENCY,
+    STRIPE_WEBHOOK_SECRET, PAYMENT_WEBHOOK_ALLOW_UNSIGNED, FAILED_GATEWAY_STATUSES
+)
+from inventory import reserve_stock, release_stock, settle_paid_stock, expire_reservations
 from schemas import *
 from auth import *
 import os
-import sys
 from datetime import datetime
 from typing import List, Optional
 from bson import ObjectId
 from enum import Enum
 
 try:
-    from payment import create_payment_intent, confirm_payment, mock_payment
+    from payment import (
+        create_payment_intent, confirm_payment, mock_payment,
+        close_payment_gateway, payment_gateway_stats
+    )
     STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY", "sk_test_your_stripe_secret_key")
 except ImportError:
     def mock_payment(amount, method):
         return {"transaction_id": f"mock_{hash(str(amount))}", "status": "completed", "amount": amount}
-    def create_payment_intent(amount, currency, metadata):
+    async def create_payment_intent(amount, currency, metadata, idempotency_key=None):
         return {"client_secret": None, "payment_intent_id": f"mock_{hash(str(amount))}", "status": "requires_payment_method"}
-    def confirm_payment(intent_id):
+    async def confirm_payment(intent_id):
         return {"status": "completed", "amount": 0, "currency": "INR"}
+    async def close_payment_gateway():
+        pass
+    def payment_gateway_stats():
+        return {}
     STRIPE_SECRET_KEY = "sk_test_mock"
 from shipping import (
     generate_tracking_number, calculate_shipping_cost, 
-    calculate_distance, estimate_delivery_time, update_shipping_location
+    calculate_distance, estimate_delivery_time, update_shipping_location,
+    quote_shipping, DEFAULT_ORIGIN, to_utc_naive, utc_now
+)
+from coupon_service import (
+    validate_coupon, apply_coupon, release_coupon, invalidate_coupon, coupon_cache_stats
+)
+from cache import LRUCache, create_response_cache
+from catalog_io import import_products, export_products, iter_ndjson, json_default
+from category_index import (
+    record_product_added, refresh_categories, list_categories, rebuild_categories
 )
-from coupon_service import validate_coupon, apply_coupon
-from jose import jwt, JWTError
+from loaders import load_products
+from analytics import (
+    record_order_placed, record_payment_completed, record_payment_reversed,
+    get_sales_rollups, get_payment_totals
+)
+from pymongo import ReturnDocument, UpdateOne
+from pagination import (
+    DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, encode_cursor, decode_cursor,
+    build_projection, keyset_filter, fetch_page
+)
+from jose import JWTError
 
-import ctypes
+import asyncio
+import json
 
 app = FastAPI(title="Advanced E-Commerce API", version="2.0.0")
 
@@ -43,44 +81,97 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
 # ---------- STARTUP ----------
+RESERVATION_SWEEP_SECONDS = 60
+
+payment_reconciler = PaymentReconciler(
+    payment_events, payments, orders, products, stock_reservations, sales_rollups
+)
+
+async def sweep_expired_reservations():
+    """Release stock held by checkouts that were never paid and cancel those orders"""
+    while True:
+        try:
+            expired = await expire_reservations(products, stock_reservations)
+            if expired:
+                await orders.update_many(
+                    {
+                        "_id": {"$in": [ObjectId(order_id) for order_id in expired]},
+                        "payment_status": {"$ne": PaymentStatus.COMPLETED}
+                    },
+                    {"$set": {"status": OrderStatus.CANCELLED}}
+                )
+                print(f"Released stock for {len(expired)} expired checkouts")
+        except Exception as e:
+            print(f"Warning: reservation sweep failed: {e}")
+        await asyncio.sleep(RESERVATION_SWEEP_SECONDS)
+
+async def report_index_reconciliation():
+    results = await reconcile_indexes()
+    changes = {name: r for name, r in results.items() if any(r.values())}
+    print(f"Database indexes reconciled: {changes or 'no changes'}")
+
 @app.on_event("startup")
 async def startup_event():
-    await create_indexes()
-    print("Database indexes created")
+    # Index builds can take a while on large collections; don't hold up startup
+    asyncio.create_task(report_index_reconciliation())
+    index = await load_warehouses(warehouses)
+    print(f"Warehouse index loaded ({len(index)} warehouses)")
+    if await categories.estimated_document_count() == 0:
+        count = await rebuild_categories(products, categories)
+        print(f"Category index built ({count} categories)")
+    asyncio.create_task(sweep_expired_reservations())
+    asyncio.create_task(payment_reconciler.run())
 
-# ---------- LOAD C++ DISCOUNT ENGINE ----------
-try:
-    if sys.platform == "win32":
-        dll_path = os.path.join(os.path.dirname(__file__), "..", "cpp-engine", "discount.dll")
-        if os.path.exists(dll_path):
-            discount = ctypes.CDLL(dll_path)
-        else:
-            discount = None
-    else:
-        so_path = os.path.join(os.path.dirname(__file__), "..", "cpp-engine", "discount.so")
-        if os.path.exists(so_path):
-            discount = ctypes.CDLL(so_path)
-        else:
-            discount = None
-    
-    if discount:
-        discount.applyDiscount.restype = ctypes.c_double
-except Exception as e:
-    print(f"Warning: Could not load C++ discount engine: {e}")
-    discount = None
+@app.on_event("shutdown")
+async def shutdown_event():
+    await close_payment_gateway()
 
-def apply_discount(price, percent):
-    if discount:
-        try:
-            return discount.applyDiscount(ctypes.c_double(price), ctypes.c_int(percent))
-        except:
-            pass
-    if percent < 0 or percent > 70:
-        return price
-    return price - (price * percent / 100.0)
+# ---------- LISTING HELPERS ----------
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "1000"))
+
+async def paged_listing(collection, query: dict, limit: int, cursor: Optional[str],
+                        response: Response, descending: bool = False):
+    """One keyset page of a collection, with the next cursor in X-Next-Cursor"""
+    try:
+        docs, next_cursor = await fetch_page(collection, query, limit, cursor, descending)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    for doc in docs:
+        doc["_id"] = str(doc["_id"])
+    return docs
+
+def streamed_listing(cursor):
+    """Stream every document of a Motor cursor as NDJSON in constant memory"""
+    return StreamingResponse(
+        iter_ndjson(cursor.batch_size(STREAM_BATCH_SIZE)),
+        media_type="application/x-ndjson"
+    )
+
+# ---------- CATALOG RESPONSE CACHE ----------
+catalog_cache = create_response_cache(ttl=float(os.getenv("CATALOG_CACHE_TTL", "60")))
+CATALOG = "catalog"
+
+async def cached_catalog_response(request: Request, params: dict, compute):
+    """Serve a catalog read from catalog_cache, answering If-None-Match with 304.
+    
+    compute() is awaited on a miss and returns (body, headers).
+    """
+    key = await catalog_cache.key(CATALOG, params)
+    entry = await catalog_cache.get(key)
+    if entry is None:
+        body, headers = await compute()
+        entry = await catalog_cache.set(key, jsonable_encoder(body), headers)
+    headers = {**entry["headers"], "ETag": entry["etag"]}
+    if request.headers.get("if-none-match") == entry["etag"]:
+        catalog_cache.not_modified += 1
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(entry["body"], headers=headers)
 
 # ---------- AUTH DEPENDENCY ----------
 async def get_current_user(authorization: str = Header(None)):
@@ -88,14 +179,20 @@ async def get_current_user(authorization: str = Header(None)):
         raise HTTPException(401, "Not authenticated")
     token = authorization.split(" ")[1]
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decode_token(token)
         email = payload.get("email")
         if email is None:
             raise HTTPException(401, "Invalid token")
-        return payload
+        return dict(payload)
     except JWTError:
         raise HTTPException(401, "Invalid token")
 
+async def get_stream_user(authorization: str = Header(None), token: Optional[str] = Query(None)):
+    """Like get_current_user, but also accepts ?token= since EventSource can't send headers"""
+    if token and not authorization:
+        authorization = f"Bearer {token}"
+    return await get_current_user(authorization)
+
 async def get_admin_user(user: dict = Depends(get_current_user)):
     if user.get("role") != "admin":
         raise HTTPException(403, "Admin access required")
@@ -107,7 +204,7 @@ async def signup(user: UserSchema):
     if await users.find_one({"email": user.email}):
         raise HTTPException(400, "User exists")
     user_dict = user.dict()
-    user_dict["password"] = hash_password(user_dict["password"])
+    user_dict["password"] = await hash_password_async(user_dict["password"])
     user_dict["created_at"] = datetime.now()
     await users.insert_one(user_dict)
     return {"msg": "Signup success"}
@@ -115,7 +212,7 @@ async def signup(user: UserSchema):
 @app.post("/login")
 async def login(data: LoginSchema):
     user = await users.find_one({"email": data.email})
-    if not user or not verify_password(data.password, user["password"]):
+    if not user or not await verify_password_async(data.password, user["password"]):
         raise HTTPException(401, "Invalid login")
     token = create_token({
         "email": user["email"], 
@@ -133,13 +230,25 @@ async def logout(user: dict = Depends(get_current_user)):
     return {"msg": "Logged out successfully"}
 
 # ========== USER PROFILE ENDPOINTS ==========
+# Profiles change rarely; entries are dropped on update_profile
+profile_cache = LRUCache(maxsize=int(os.getenv("PROFILE_CACHE_SIZE", "10000")), ttl=300)
+
+async def get_user_profile(email: str):
+    """Fetch a user without the password hash, served from profile_cache when warm"""
+    user_data = profile_cache.get(email)
+    if user_data is None:
+        user_data = await users.find_one({"email": email}, {"password": 0})
+        if not user_data:
+            return None
+        user_data["_id"] = str(user_data["_id"])
+        profile_cache.set(email, user_data)
+    return dict(user_data)
+
 @app.get("/user/profile")
 async def get_profile(user: dict = Depends(get_current_user)):
-    user_data = await users.find_one({"email": user["email"]})
+    user_data = await get_user_profile(user["email"])
     if not user_data:
         raise HTTPException(404, "User not found")
-    user_data["_id"] = str(user_data["_id"])
-    user_data.pop("password", None)
     return user_data
 
 @app.put("/user/profile")
@@ -147,6 +256,7 @@ async def update_profile(update: UserUpdateSchema, user: dict = Depends(get_curr
     update_dict = {k: v for k, v in update.dict().items() if v is not None}
     if update_dict:
         await users.update_one({"email": user["email"]}, {"$set": update_dict})
+        profile_cache.delete(user["email"])
     return {"msg": "Profile updated"}
 
 # ========== ADDRESS ENDPOINTS ==========
@@ -189,45 +299,229 @@ async def add_product(p: ProductSchema, admin: dict = Depends(get_admin_user)):
     product_dict = p.dict()
     product_dict["created_at"] = datetime.now()
     result = await products.insert_one(product_dict)
+    await record_product_added(product_dict, categories)
+    await catalog_cache.invalidate(CATALOG)
     return {"id": str(result.inserted_id), "msg": "Product added"}
 
+CATALOG_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+# Per-order stock holds are internal bookkeeping, not part of the product
+PUBLIC_PRODUCT_PROJECTION = {"holds": 0}
+
+@app.post("/products/bulk")
+async def bulk_import_products(
+    file: UploadFile = File(...),
+    format: Optional[str] = Query(None),
+    admin: dict = Depends(get_admin_user)
+):
+    file_format = format or ("csv" if (file.filename or "").lower().endswith(".csv") else "ndjson")
+    if file_format not in CATALOG_FORMATS:
+        raise HTTPException(400, "Format must be ndjson or csv")
+    async def index_batch(batch):
+        await refresh_categories([p["category"] for p in batch], products, categories)
+    
+    result = await import_products(file, file_format, products, after_batch=index_batch)
+    if result["inserted"]:
+        await catalog_cache.invalidate(CATALOG)
+    return result
+
+@app.get("/products/export")
+async def bulk_export_products(
+    format: str = Query("ndjson"),
+    include_inactive: bool = Query(False),
+    admin: dict = Depends(get_admin_user)
+):
+    if format not in CATALOG_FORMATS:
+        raise HTTPException(400, "Format must be ndjson or csv")
+    query = {} if include_inactive else {"is_active": True}
+    cursor = products.find(query, PUBLIC_PRODUCT_PROJECTION).batch_size(1000)
+    return StreamingResponse(
+        export_products(cursor, format),
+        media_type=CATALOG_FORMATS[format],
+        headers={"Content-Disposition": f"attachment; filename=products.{format}"}
+    )
+
 @app.get("/products")
 async def get_products(
+    request: Request,
     category: Optional[str] = Query(None),
     search: Optional[str] = Query(None),
     min_price: Optional[float] = Query(None),
     max_price: Optional[float] = Query(None),
     featured: Optional[bool] = Query(None),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None),
+    fields: Optional[str] = Query(None),
     user: dict = Depends(get_current_user)
 ):
+    params = {
+        "route": "products", "category": category, "search": search,
+        "min_price": min_price, "max_price": max_price, "featured": featured,
+        "limit": limit, "cursor": cursor, "fields": fields
+    }
+    return await cached_catalog_response(request, params, lambda: query_products(
+        category, search, min_price, max_price, featured, limit, cursor, fields
+    ))
+
+def build_product_query(category, min_price, max_price, featured, in_stock=None) -> dict:
+    """Filter for active products, ordered to match the (is_active, category, price) index"""
     query = {"is_active": True}
     if category:
         query["category"] = category
-    if featured is not None:
-        query["is_featured"] = featured
-    if min_price or max_price:
+    if min_price is not None or max_price is not None:
         price_query = {}
-        if min_price:
+        if min_price is not None:
             price_query["$gte"] = min_price
-        if max_price:
+        if max_price is not None:
             price_query["$lte"] = max_price
         query["price"] = price_query
+    if featured is not None:
+        query["is_featured"] = featured
+    if in_stock is not None:
+        query["stock"] = {"$gt": 0} if in_stock else {"$lte": 0}
+    return query
+
+def parse_cursor(cursor: Optional[str]):
+    try:
+        return decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+async def query_products(category, search, min_price, max_price, featured, limit, cursor, fields):
+    """One page of the product listing as (products, headers)"""
+    query = build_product_query(category, min_price, max_price, featured)
+    position = parse_cursor(cursor)
+    projection = build_projection(fields, hidden=PUBLIC_PRODUCT_PROJECTION) or PUBLIC_PRODUCT_PROJECTION
     
     result = []
-    async for p in products.find(query):
+    if search:
+        # Relevance ranked search served by the name/description text index
+        query["$text"] = {"$search": search}
+        pipeline = [
+            {"$match": query},
+            {"$addFields": {"score": {"$meta": "textScore"}}},
+        ]
+        page_filter = keyset_filter(position, with_score=True)
+        if page_filter:
+            pipeline.append({"$match": page_filter})
+        pipeline += [{"$sort": {"score": -1, "_id": 1}}, {"$limit": limit}]
+        if projection is PUBLIC_PRODUCT_PROJECTION:
+            pipeline.append({"$project": projection})
+        else:
+            pipeline.append({"$project": {**projection, "score": 1}})
+        async for p in products.aggregate(pipeline):
+            result.append(p)
+    else:
+        query.update(keyset_filter(position))
+        async for p in products.find(query, projection).sort("_id", 1).limit(limit):
+            result.append(p)
+    
+    headers = {}
+    if len(result) == limit:
+        last = result[-1]
+        headers["X-Next-Cursor"] = encode_cursor(last["_id"], last.get("score"))
+    for p in result:
         p["_id"] = str(p["_id"])
-        if search and search.lower() not in p.get("name", "").lower():
-            continue
-        result.append(p)
-    return result
+    return result, headers
+
+PRICE_BUCKETS = [0, 500, 1000, 5000, 10000, 50000]
+
+@app.get("/products/facets")
+async def get_product_facets(
+    request: Request,
+    category: Optional[str] = Query(None),
+    search: Optional[str] = Query(None),
+    min_price: Optional[float] = Query(None),
+    max_price: Optional[float] = Query(None),
+    featured: Optional[bool] = Query(None),
+    in_stock: Optional[bool] = Query(None),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None),
+    user: dict = Depends(get_current_user)
+):
+    params = {
+        "route": "facets", "category": category, "search": search,
+        "min_price": min_price, "max_price": max_price, "featured": featured,
+        "in_stock": in_stock, "limit": limit, "cursor": cursor
+    }
+    return await cached_catalog_response(request, params, lambda: query_product_facets(
+        category, search, min_price, max_price, featured, in_stock, limit, cursor
+    ))
+
+async def query_product_facets(category, search, min_price, max_price, featured,
+                               in_stock, limit, cursor):
+    """Facet counts and one page of matching products from a single $facet aggregation"""
+    query = build_product_query(category, min_price, max_price, featured, in_stock)
+    position = parse_cursor(cursor)
+    
+    pipeline = []
+    if search:
+        query["$text"] = {"$search": search}
+        pipeline += [{"$match": query}, {"$addFields": {"score": {"$meta": "textScore"}}}]
+        sort = {"score": -1, "_id": 1}
+    else:
+        pipeline.append({"$match": query})
+        sort = {"_id": 1}
+    
+    page = []
+    page_filter = keyset_filter(position, with_score=bool(search))
+    if page_filter:
+        page.append({"$match": page_filter})
+    page += [{"$sort": sort}, {"$limit": limit}, {"$project": PUBLIC_PRODUCT_PROJECTION}]
+    
+    pipeline.append({"$facet": {
+        "results": page,
+        "total": [{"$count": "count"}],
+        "categories": [{"$sortByCount": "$category"}],
+        "price_ranges": [{"$bucket": {
+            "groupBy": "$price",
+            "boundaries": PRICE_BUCKETS,
+            "default": f"{PRICE_BUCKETS[-1]}+",
+            "output": {"count": {"$sum": 1}}
+        }}],
+        # Products without the flag count as not featured, in the same group as False
+        "featured": [{"$group": {"_id": {"$ifNull": ["$is_featured", False]}, "count": {"$sum": 1}}}],
+        "in_stock": [{"$group": {"_id": {"$gt": ["$stock", 0]}, "count": {"$sum": 1}}}]
+    }})
+    
+    facets = (await products.aggregate(pipeline).to_list(1))[0]
+    results = facets["results"]
+    headers = {}
+    if len(results) == limit:
+        last = results[-1]
+        headers["X-Next-Cursor"] = encode_cursor(last["_id"], last.get("score"))
+    for p in results:
+        p["_id"] = str(p["_id"])
+    
+    price_ranges = []
+    for bucket in facets["price_ranges"]:
+        lower = bucket["_id"]
+        if isinstance(lower, str):
+            price_ranges.append({"min": PRICE_BUCKETS[-1], "max": None, "count": bucket["count"]})
+        else:
+            upper = PRICE_BUCKETS[PRICE_BUCKETS.index(lower) + 1]
+            price_ranges.append({"min": lower, "max": upper, "count": bucket["count"]})
+    
+    body = {
+        "total": facets["total"][0]["count"] if facets["total"] else 0,
+        "facets": {
+            "category": [{"value": f["_id"], "count": f["count"]} for f in facets["categories"]],
+            "price": price_ranges,
+            "featured": {str(bool(f["_id"])).lower(): f["count"] for f in facets["featured"]},
+            "in_stock": {str(f["_id"]).lower(): f["count"] for f in facets["in_stock"]}
+        },
+        "results": results
+    }
+    return body, headers
 
 @app.get("/products/{product_id}")
-async def get_product(product_id: str, user: dict = Depends(get_current_user)):
-    product = await products.find_one({"_id": ObjectId(product_id)})
-    if not product:
-        raise HTTPException(404, "Product not found")
-    product["_id"] = str(product["_id"])
-    return product
+async def get_product(product_id: str, request: Request, user: dict = Depends(get_current_user)):
+    async def compute():
+        product = await products.find_one({"_id": ObjectId(product_id)}, PUBLIC_PRODUCT_PROJECTION)
+        if not product:
+            raise HTTPException(404, "Product not found")
+        product["_id"] = str(product["_id"])
+        return product, {}
+    return await cached_catalog_response(request, {"route": "product", "id": product_id}, compute)
 
 @app.put("/products/{product_id}")
 async def update_product(
@@ -237,75 +531,132 @@ async def update_product(
 ):
     update_dict = {k: v for k, v in update.dict().items() if v is not None}
     if update_dict:
-        await products.update_one({"_id": ObjectId(product_id)}, {"$set": update_dict})
+        before = await products.find_one_and_update(
+            {"_id": ObjectId(product_id)}, {"$set": update_dict}, projection={"category": 1}
+        )
+        if before:
+            await refresh_categories(
+                [before.get("category"), update_dict.get("category")], products, categories
+            )
+        await catalog_cache.invalidate(CATALOG)
     return {"msg": "Product updated"}
 
 @app.delete("/products/{product_id}")
 async def delete_product(product_id: str, admin: dict = Depends(get_admin_user)):
-    await products.update_one({"_id": ObjectId(product_id)}, {"$set": {"is_active": False}})
+    before = await products.find_one_and_update(
+        {"_id": ObjectId(product_id)}, {"$set": {"is_active": False}}, projection={"category": 1}
+    )
+    if before:
+        await refresh_categories([before.get("category")], products, categories)
+    await catalog_cache.invalidate(CATALOG)
     return {"msg": "Product deleted"}
 
 @app.get("/products/categories/list")
-async def get_categories(user: dict = Depends(get_current_user)):
-    categories_list = await products.distinct("category")
-    return {"categories": categories_list}
+async def get_categories(request: Request, user: dict = Depends(get_current_user)):
+    async def compute():
+        details = await list_categories(categories)
+        return {"categories": [c["name"] for c in details], "details": details}, {}
+    return await cached_catalog_response(request, {"route": "categories"}, compute)
 
 # ========== CART ENDPOINTS ==========
+cart_store = create_cart_store(cart, carts)
+MAX_CART_LINES = int(os.getenv("MAX_CART_LINES", "200"))
+
 @app.post("/cart/add")
 async def add_to_cart(item: CartItemSchema, user: dict = Depends(get_current_user)):
-    product = await products.find_one({"_id": ObjectId(item.product_id)})
-    if not product:
+    product = await products.find_one({"_id": ObjectId(item.product_id)}, {"stock": 1, "is_active": 1})
+    if not product or not product.get("is_active", True):
         raise HTTPException(404, "Product not found")
+    if product.get("stock", 0) < item.quantity:
+        raise HTTPException(409, "Insufficient stock")
     
-    cart_item = {
-        "user_email": user["email"],
-        "product_id": item.product_id,
-        "quantity": item.quantity,
-        "price": item.price,
-        "added_at": datetime.now()
-    }
-    
-    await cart.update_one(
-        {"user_email": user["email"], "product_id": item.product_id},
-        {"$set": cart_item},
-        upsert=True
-    )
+    await cart_store.add_line(user["email"], item.product_id, item.quantity)
     return {"msg": "Item added to cart"}
 
+@app.put("/cart")
+async def put_cart(body: CartBulkSchema, user: dict = Depends(get_current_user)):
+    """Replace the cart with the given lines, or merge them into it.
+    
+    A single atomic update with CART_LAYOUT=document; two writes with the line layout.
+    """
+    if body.mode not in ("replace", "merge"):
+        raise HTTPException(400, "mode must be replace or merge")
+    if len(body.items) > MAX_CART_LINES:
+        raise HTTPException(413, f"At most {MAX_CART_LINES} lines per request")
+    
+    lines = {}
+    for item in body.items:
+        if not ObjectId.is_valid(item.product_id):
+            raise HTTPException(400, f"Invalid line for product {item.product_id}")
+        lines[item.product_id] = item.quantity  # Later duplicates win
+    
+    wanted = [pid for pid, quantity in lines.items() if quantity > 0]
+    product_map = await load_products(wanted, products, {"stock": 1, "is_active": 1})
+    unavailable = [pid for pid in wanted
+                   if pid not in product_map or not product_map[pid].get("is_active", True)]
+    if unavailable:
+        raise HTTPException(404, {"msg": "Products not found", "product_ids": unavailable})
+    short = [pid for pid in wanted if product_map[pid].get("stock", 0) < lines[pid]]
+    if short:
+        raise HTTPException(409, {"msg": "Insufficient stock", "product_ids": short})
+    
+    try:
+        await cart_store.put_lines(user["email"], lines, replace=body.mode == "replace")
+    except RuntimeError as e:
+        raise HTTPException(409, str(e))
+    return {"msg": "Cart updated", "lines": len(wanted)}
+
 @app.get("/cart")
-async def get_cart(user: dict = Depends(get_current_user)):
-    cart_items = []
-    total = 0.0
-    
-    async for item in cart.find({"user_email": user["email"]}):
-        product = await products.find_one({"_id": ObjectId(item["product_id"])})
-        if product:
-            item_total = item["quantity"] * item["price"]
-            total += item_total
-            cart_items.append({
-                "id": str(item["_id"]),
-                "product": {
-                    "id": str(product["_id"]),
-                    "name": product["name"],
-                    "price": product["price"],
-                    "images": product.get("images", [])
-                },
-                "quantity": item["quantity"],
-                "total": item_total
-            })
+async def get_cart(
+    coupon_code: Optional[str] = Query(None),
+    user: dict = Depends(get_current_user)
+):
+    lines = await cart_store.get_lines(user["email"])
+    try:
+        priced = await price_cart(
+            user["email"], lines, products, await catalog_cache.generation(CATALOG)
+        )
+    except ValueError as e:
+        raise HTTPException(400, str(e))
     
-    return {"items": cart_items, "total": round(total, 2)}
+    cart_items = [{
+        "id": str(line["line_id"]),
+        "product": {
+            "id": line["product_id"],
+            "name": line["product_name"],
+            "price": line["price"],
+            "list_price": line["list_price"],
+            "images": line["images"]
+        },
+        "quantity": line["quantity"],
+        "total": line["total"]
+    } for line in priced["items"]]
+    
+    discount_amount = 0.0
+    if coupon_code:
+        coupon_result = await validate_coupon(coupon_code, priced["subtotal"], coupons)
+        if coupon_result["valid"]:
+            discount_amount = coupon_result["discount_amount"]
+    totals = order_totals(priced["subtotal"], discount_amount)
+    
+    return {
+        "items": cart_items,
+        "subtotal": totals["subtotal"],
+        "discount": totals["discount"],
+        "tax": totals["tax"],
+        "total": totals["total"],
+        "unavailable": priced["unavailable"]
+    }
 
 @app.delete("/cart/{item_id}")
 async def remove_from_cart(item_id: str, user: dict = Depends(get_current_user)):
-    result = await cart.delete_one({"_id": ObjectId(item_id), "user_email": user["email"]})
-    if result.deleted_count == 0:
+    if not await cart_store.remove_line(user["email"], item_id):
         raise HTTPException(404, "Item not found")
     return {"msg": "Item removed from cart"}
 
 @app.delete("/cart")
 async def clear_cart(user: dict = Depends(get_current_user)):
-    await cart.delete_many({"user_email": user["email"]})
+    await cart_store.clear(user["email"])
     return {"msg": "Cart cleared"}
 
 # ========== COUPON ENDPOINTS ==========
@@ -319,6 +670,7 @@ async def create_coupon(coupon: CouponSchema, admin: dict = Depends(get_admin_us
         raise HTTPException(400, "Coupon code already exists")
     
     result = await coupons.insert_one(coupon_dict)
+    invalidate_coupon(coupon_dict["code"])
     return {"id": str(result.inserted_id), "msg": "Coupon created"}
 
 @app.post("/coupons/validate")
@@ -330,43 +682,93 @@ async def validate_coupon_code(
     return result
 
 @app.get("/coupons")
-async def get_coupons(admin: dict = Depends(get_admin_user)):
-    result = []
-    async for c in coupons.find({"is_active": True}):
-        c["_id"] = str(c["_id"])
-        result.append(c)
-    return result
+async def get_coupons(
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None),
+    stream: bool = Query(False),
+    admin: dict = Depends(get_admin_user)
+):
+    query = {"is_active": True}
+    if stream:
+        return streamed_listing(coupons.find(query))
+    return await paged_listing(coupons, query, limit, cursor, response)
 
 # ========== ORDER ENDPOINTS ==========
+async def mark_order_paid(order_id: str):
+    """Flip an order to Completed once, adding it to the sales rollups"""
+    order = await orders.find_one_and_update(
+        {"_id": ObjectId(order_id), "payment_status": {"$ne": PaymentStatus.COMPLETED}},
+        {"$set": {"payment_status": PaymentStatus.COMPLETED}},
+        return_document=ReturnDocument.AFTER
+    )
+    if order:
+        await asyncio.gather(
+            record_payment_completed(order, sales_rollups, products),
+            settle_paid_stock(order, products, stock_reservations, orders)
+        )
+
+async def mark_order_unpaid(order_id: str, payment_status: str):
+    """Move an order out of Completed once, taking its revenue back out of the rollups"""
+    order = await orders.find_one_and_update(
+        {"_id": ObjectId(order_id), "payment_status": PaymentStatus.COMPLETED},
+        {"$set": {"payment_status": payment_status}},
+        return_document=ReturnDocument.BEFORE
+    )
+    if order:
+        await record_payment_reversed(order, sales_rollups, products)
+
 @app.post("/orders")
 async def create_order(order: OrderSchema, user: dict = Depends(get_current_user)):
     if order.user_email != user["email"]:
         raise HTTPException(403, "Cannot create order for another user")
     
-    # Apply coupon if provided
+    # Price every line from the catalog; client-supplied amounts are not trusted.
+    # Always read current prices here - the priced-cart cache is only for GET /cart
+    try:
+        priced = await price_lines(
+            [{"product_id": i.product_id, "quantity": i.quantity} for i in order.items],
+            products
+        )
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    if priced["unavailable"]:
+        raise HTTPException(409, {"msg": "Products unavailable", "product_ids": priced["unavailable"]})
+    
+    # Reserve coupon use atomically if provided
     discount_amount = 0.0
+    coupon_reserved = False
     if order.coupon_code:
-        coupon_result = await apply_coupon(order.coupon_code, order.subtotal, coupons)
+        coupon_result = await apply_coupon(order.coupon_code, priced["subtotal"], coupons)
         if coupon_result["valid"]:
             discount_amount = coupon_result["discount_amount"]
+            coupon_reserved = True
+    
+    # Calculate final total, shipping from the nearest warehouse
+    delivery = delivery_quote(order.shipping_address)
+    totals = order_totals(priced["subtotal"], discount_amount, delivery["cost"])
+    final_total = totals["total"]
     
-    # Calculate final total
-    final_total = order.subtotal + order.shipping_cost + order.tax - discount_amount
+    # Allocate the id up front so the independent writes below can run together
+    order_oid = ObjectId()
+    order_id = str(order_oid)
     
     order_dict = order.dict()
-    order_dict["total"] = final_total
-    order_dict["discount"] = discount_amount
+    order_dict["_id"] = order_oid
+    order_dict["items"] = [
+        {k: line[k] for k in ("product_id", "product_name", "quantity", "price", "total")}
+        for line in priced["items"]
+    ]
+    order_dict.update(totals)
+    # Payment settles only through mark_order_paid or the reconciler
+    order_dict["payment_status"] = PaymentStatus.PENDING
     order_dict["created_at"] = datetime.now()
     
     # Generate tracking number
     tracking_number = generate_tracking_number()
     order_dict["tracking_number"] = tracking_number
     
-    # Create order
-    result = await orders.insert_one(order_dict)
-    order_id = str(result.inserted_id)
-    
-    # Create shipping tracker
+    # Shipping tracker
     shipping_location = {
         "order_id": order_id,
         "tracking_number": tracking_number,
@@ -374,17 +776,36 @@ async def create_order(order: OrderSchema, user: dict = Depends(get_current_user
             "latitude": order.shipping_address.latitude or 0.0,
             "longitude": order.shipping_address.longitude or 0.0,
             "address": f"{order.shipping_address.street}, {order.shipping_address.city}",
-            "timestamp": datetime.now(),
+            "timestamp": utc_now(),
             "status": order.status.value,
             "description": "Order placed"
         },
         "history": [],
-        "estimated_delivery": estimate_delivery_time(100)  # Default distance
+        "origin_warehouse": delivery["warehouse"],
+        "estimated_delivery": estimate_delivery_time(delivery["distance_km"])
     }
-    await shipping_trackers.insert_one(shipping_location)
     
-    # Clear cart
-    await cart.delete_many({"user_email": user["email"]})
+    # Hold stock for every line before the order exists
+    short = await reserve_stock(order_id, order_dict["items"], products, stock_reservations)
+    if short:
+        if coupon_reserved:
+            await release_coupon(order.coupon_code, coupons)
+        raise HTTPException(409, {"msg": "Insufficient stock", "product_ids": short})
+    
+    try:
+        await orders.insert_one(order_dict)
+    except Exception:
+        await release_stock(order_id, products, stock_reservations)
+        if coupon_reserved:
+            await release_coupon(order.coupon_code, coupons)
+        raise
+    
+    # Tracker, cart clearing and analytics don't depend on each other
+    await asyncio.gather(
+        shipping_trackers.insert_one(shipping_location),
+        cart_store.clear(user["email"]),
+        record_order_placed(order_dict, sales_rollups),
+    )
     
     return {
         "order_id": order_id,
@@ -394,16 +815,21 @@ async def create_order(order: OrderSchema, user: dict = Depends(get_current_user
     }
 
 @app.get("/orders")
-async def get_orders(user: dict = Depends(get_current_user)):
+async def get_orders(
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None),
+    stream: bool = Query(False),
+    user: dict = Depends(get_current_user)
+):
     query = {"user_email": user["email"]}
     if user.get("role") == "admin":
         query = {}  # Admin can see all orders
     
-    result = []
-    async for o in orders.find(query).sort("created_at", -1):
-        o["_id"] = str(o["_id"])
-        result.append(o)
-    return result
+    # Newest first; _id order matches created_at since both are set at insert
+    if stream:
+        return streamed_listing(orders.find(query).sort("_id", -1))
+    return await paged_listing(orders, query, limit, cursor, response, descending=True)
 
 @app.get("/orders/{order_id}")
 async def get_order(order_id: str, user: dict = Depends(get_current_user)):
@@ -426,6 +852,18 @@ async def update_order(
     update_dict = {k: v.value if isinstance(v, Enum) else v 
                    for k, v in update.dict().items() if v is not None}
     
+    if update_dict.get("payment_status") == PaymentStatus.COMPLETED:
+        await mark_order_paid(order_id)
+    elif "payment_status" in update_dict:
+        await mark_order_unpaid(order_id, update_dict["payment_status"])
+    if update_dict.get("status") == OrderStatus.CANCELLED:
+        await release_stock(order_id, products, stock_reservations)
+    
+    status_time = utc_now()
+    if "status" in update_dict:
+        # Carrier pings stamped before this change must not overwrite it
+        update_dict["tracking_updated_at"] = status_time
+    
     if update_dict:
         await orders.update_one({"_id": ObjectId(order_id)}, {"$set": update_dict})
         
@@ -437,23 +875,50 @@ async def update_order(
                     "latitude": tracker["current_location"]["latitude"],
                     "longitude": tracker["current_location"]["longitude"],
                     "address": tracker["current_location"]["address"],
-                    "timestamp": datetime.now(),
+                    "timestamp": status_time,
                     "status": update_dict["status"],
                     "description": f"Status updated to {update_dict['status']}"
                 }
-                await shipping_trackers.update_one(
-                    {"order_id": order_id},
-                    {
-                        "$set": {"current_location": new_location},
-                        "$push": {"history": new_location}
-                    }
-                )
+                await append_tracking_event({"order_id": order_id}, new_location)
     
     return {"msg": "Order updated"}
 
 # ========== SHIPPING TRACKER ENDPOINTS ==========
+TRACKER_HISTORY_LIMIT = int(os.getenv("TRACKER_HISTORY_LIMIT", "20"))
+STREAM_HEARTBEAT_SECONDS = 15
+
+tracking_hub = TrackingHub()
+
+async def append_tracking_event(tracker_filter: dict, location: dict):
+    """Move a tracker to a new location and log the event.
+    
+    The tracker document only keeps the latest TRACKER_HISTORY_LIMIT entries;
+    the full history lives in shipping_events.
+    """
+    tracker = await shipping_trackers.find_one_and_update(
+        tracker_filter,
+        {
+            "$set": {"current_location": location},
+            "$push": {"history": {"$each": [location], "$slice": -TRACKER_HISTORY_LIMIT}}
+        },
+        projection={"tracking_number": 1, "order_id": 1}
+    )
+    if tracker:
+        await shipping_events.insert_one({
+            "tracking_number": tracker["tracking_number"],
+            "order_id": tracker["order_id"],
+            **location
+        })
+        tracking_hub.publish(tracker["tracking_number"], location)
+    return tracker
+
 @app.get("/track/{tracking_number}")
-async def track_order(tracking_number: str, user: dict = Depends(get_current_user)):
+async def track_order(
+    tracking_number: str,
+    since: Optional[datetime] = Query(None),
+    limit: int = Query(TRACKER_HISTORY_LIMIT, ge=1, le=1000),
+    user: dict = Depends(get_current_user)
+):
     tracker = await shipping_trackers.find_one({"tracking_number": tracking_number})
     if not tracker:
         raise HTTPException(404, "Tracking number not found")
@@ -463,48 +928,240 @@ async def track_order(tracking_number: str, user: dict = Depends(get_current_use
     if order and order["user_email"] != user["email"] and user.get("role") != "admin":
         raise HTTPException(403, "Access denied")
     
+    if since:
+        # Older or longer histories come from the event log
+        events = shipping_events.find(
+            {"tracking_number": tracking_number, "timestamp": {"$gt": since}},
+            {"_id": 0, "tracking_number": 0, "order_id": 0}
+        ).sort("timestamp", 1).limit(limit)
+        tracker["history"] = await events.to_list(limit)
+    else:
+        tracker["history"] = tracker.get("history", [])[-limit:]
+    
     tracker["_id"] = str(tracker["_id"])
     return tracker
 
+@app.get("/track/{tracking_number}/stream")
+async def stream_tracking(tracking_number: str, user: dict = Depends(get_stream_user)):
+    """Server-Sent Events feed of location/status updates for one shipment"""
+    # Subscribe before reading the snapshot so no update can slip in between
+    queue = tracking_hub.subscribe(tracking_number)
+    try:
+        tracker = await shipping_trackers.find_one(
+            {"tracking_number": tracking_number}, {"current_location": 1}
+        )
+        if not tracker:
+            raise HTTPException(404, "Tracking number not found")
+        
+        order = await orders.find_one({"tracking_number": tracking_number}, {"user_email": 1})
+        if order and order["user_email"] != user["email"] and user.get("role") != "admin":
+            raise HTTPException(403, "Access denied")
+    except Exception:
+        tracking_hub.unsubscribe(tracking_number, queue)
+        raise
+    
+    def sse(event: dict) -> str:
+        return f"event: location\ndata: {json.dumps(event, default=json_default)}\n\n"
+    
+    async def events():
+        try:
+            yield sse(tracker["current_location"])
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), STREAM_HEARTBEAT_SECONDS)
+                    yield sse(event)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+        finally:
+            tracking_hub.unsubscribe(tracking_number, queue)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.put("/track/{tracking_number}/location")
 async def update_tracking_location(
     tracking_number: str,
     location: ShippingLocationSchema,
     admin: dict = Depends(get_admin_user)
 ):
-    tracker = await shipping_trackers.find_one({"tracking_number": tracking_number})
-    if not tracker:
-        raise HTTPException(404, "Tracking number not found")
-    
     location_dict = location.dict()
-    location_dict["timestamp"] = datetime.now()
+    # Tracking times are naive UTC so the ordering guards compare like with like
+    location_dict["timestamp"] = utc_now()
     
-    await shipping_trackers.update_one(
-        {"tracking_number": tracking_number},
-        {
-            "$set": {"current_location": location_dict},
-            "$push": {"history": location_dict}
-        }
-    )
+    tracker = await append_tracking_event({"tracking_number": tracking_number}, location_dict)
+    if not tracker:
+        raise HTTPException(404, "Tracking number not found")
     
-    # Update order status
+    # Update order status unless a newer carrier ping already has
     await orders.update_one(
-        {"tracking_number": tracking_number},
-        {"$set": {"status": location.status}}
+        {"tracking_number": tracking_number, "$or": [
+            {"tracking_updated_at": {"$lt": location_dict["timestamp"]}},
+            {"tracking_updated_at": {"$exists": False}}
+        ]},
+        {"$set": {"status": location.status, "tracking_updated_at": location_dict["timestamp"]}}
     )
     
     return {"msg": "Location updated"}
 
+MAX_TRACKING_BATCH = 5000
+
+@app.post("/track/locations/batch")
+async def ingest_tracking_locations(
+    events: List[TrackingEventSchema],
+    admin: dict = Depends(get_admin_user)
+):
+    if len(events) > MAX_TRACKING_BATCH:
+        raise HTTPException(413, f"At most {MAX_TRACKING_BATCH} events per batch")
+    
+    # Coalesce pings per shipment in time order; carriers may send naive or offset times
+    by_shipment = {}
+    for event in events:
+        loc = event.dict()
+        loc["timestamp"] = to_utc_naive(loc["timestamp"])
+        by_shipment.setdefault(event.tracking_number, []).append(loc)
+    
+    known = {}
+    async for tracker in shipping_trackers.find(
+        {"tracking_number": {"$in": list(by_shipment)}}, {"tracking_number": 1, "order_id": 1}
+    ):
+        known[tracker["tracking_number"]] = tracker["order_id"]
+    
+    tracker_updates = []
+    order_updates = []
+    event_docs = []
+    for tracking_number, locations in by_shipment.items():
+        if tracking_number not in known:
+            continue
+        locations.sort(key=lambda loc: loc["timestamp"])
+        for loc in locations:
+            loc.pop("tracking_number")
+            event_docs.append({
+                "tracking_number": tracking_number,
+                "order_id": known[tracking_number],
+                **loc
+            })
+        latest = locations[-1]
+        tracker_updates.append(UpdateOne(
+            {"tracking_number": tracking_number},
+            {"$push": {"history": {
+                "$each": locations[-TRACKER_HISTORY_LIMIT:],
+                "$slice": -TRACKER_HISTORY_LIMIT
+            }}}
+        ))
+        # Batches can arrive out of order; never move a shipment back to an older ping
+        tracker_updates.append(UpdateOne(
+            {"tracking_number": tracking_number, "$or": [
+                {"current_location.timestamp": {"$lt": latest["timestamp"]}},
+                {"current_location.timestamp": {"$exists": False}}
+            ]},
+            {"$set": {"current_location": latest}}
+        ))
+        order_updates.append(UpdateOne(
+            {"tracking_number": tracking_number, "$or": [
+                {"tracking_updated_at": {"$lt": latest["timestamp"]}},
+                {"tracking_updated_at": {"$exists": False}}
+            ]},
+            {"$set": {"status": latest["status"], "tracking_updated_at": latest["timestamp"]}}
+        ))
+    
+    if tracker_updates:
+        await asyncio.gather(
+            shipping_trackers.bulk_write(tracker_updates, ordered=False),
+            orders.bulk_write(order_updates, ordered=False),
+            shipping_events.insert_many(event_docs, ordered=False)
+        )
+        for tracking_number, locations in by_shipment.items():
+            if tracking_number in known:
+                for loc in locations:
+                    tracking_hub.publish(tracking_number, loc)
+    
+    return {
+        "accepted": len(event_docs),
+        "shipments": len(order_updates),
+        "unknown_tracking_numbers": [t for t in by_shipment if t not in known]
+    }
+
+# ========== SHIPPING QUOTE ENDPOINTS ==========
+MAX_QUOTE_ROUTES = 1000
+
+def dispatch_origin(latitude: float, longitude: float) -> tuple:
+    """Coordinates of the nearest warehouse to a destination, or the default dispatch point"""
+    warehouse = nearest_warehouse(latitude, longitude)
+    if warehouse is None:
+        return DEFAULT_ORIGIN
+    return (warehouse["latitude"], warehouse["longitude"])
+
+def delivery_quote(address: AddressSchema) -> dict:
+    """Shipping quote from the nearest warehouse to an address.
+    
+    Addresses without coordinates are treated as 100 km away.
+    """
+    if address.latitude is None or address.longitude is None:
+        return {"distance_km": 100, "cost": calculate_shipping_cost(100), "warehouse": None}
+    warehouse = nearest_warehouse(address.latitude, address.longitude)
+    origin = (warehouse["latitude"], warehouse["longitude"]) if warehouse else DEFAULT_ORIGIN
+    quote = quote_shipping([origin], [(address.latitude, address.longitude)])[0]
+    quote["warehouse"] = warehouse["name"] if warehouse else None
+    return quote
+
+@app.post("/shipping/quote")
+async def get_shipping_quotes(quote: ShippingQuoteSchema, user: dict = Depends(get_current_user)):
+    if len(quote.routes) > MAX_QUOTE_ROUTES:
+        raise HTTPException(413, f"At most {MAX_QUOTE_ROUTES} routes per quote")
+    if not quote.routes:
+        return {"quotes": []}
+    origins = [
+        (r.origin_latitude, r.origin_longitude)
+        if r.origin_latitude is not None and r.origin_longitude is not None
+        else dispatch_origin(r.destination_latitude, r.destination_longitude)
+        for r in quote.routes
+    ]
+    destinations = [(r.destination_latitude, r.destination_longitude) for r in quote.routes]
+    weights = [r.weight_kg for r in quote.routes]
+    return {"quotes": quote_shipping(origins, destinations, weights)}
+
+@app.post("/admin/warehouses")
+async def add_warehouse(warehouse: WarehouseSchema, admin: dict = Depends(get_admin_user)):
+    if await warehouses.find_one({"name": warehouse.name}):
+        raise HTTPException(400, "Warehouse already exists")
+    result = await warehouses.insert_one(warehouse.dict())
+    await load_warehouses(warehouses)
+    return {"id": str(result.inserted_id), "msg": "Warehouse added"}
+
+@app.get("/admin/warehouses")
+async def get_warehouses(admin: dict = Depends(get_admin_user)):
+    result = []
+    async for w in warehouses.find():
+        w["_id"] = str(w["_id"])
+        result.append(w)
+    return result
+
 # ========== PAYMENT ENDPOINTS ==========
 @app.post("/payments/intent")
 async def create_payment_intent_endpoint(
     payment_data: PaymentIntentSchema,
+    idempotency_key: Optional[str] = Header(None),
     user: dict = Depends(get_current_user)
 ):
+    # An intent tagged with an order charges that order's total, not a client-chosen amount
+    amount, currency = payment_data.amount, payment_data.currency
+    if payment_data.order_id:
+        order = None
+        if ObjectId.is_valid(payment_data.order_id):
+            order = await orders.find_one(
+                {"_id": ObjectId(payment_data.order_id)}, {"user_email": 1, "total": 1, "currency": 1}
+            )
+        if not order or order["user_email"] != user["email"]:
+            raise HTTPException(404, "Order not found")
+        amount, currency = order["total"], order.get("currency", ORDER_CURRENCY)
+    
     try:
         if STRIPE_SECRET_KEY.startswith("sk_test"):
             # Use mock payment for development
-            result = mock_payment(payment_data.amount, payment_data.payment_method.value)
+            result = mock_payment(amount, payment_data.payment_method.value)
             return {
                 "client_secret": None,
                 "payment_intent_id": result["transaction_id"],
@@ -512,10 +1169,15 @@ async def create_payment_intent_endpoint(
                 "mock": True
             }
         else:
-            result = create_payment_intent(
-                payment_data.amount,
-                payment_data.currency,
-                {"user_email": user["email"]}
+            metadata = {"user_email": user["email"]}
+            if payment_data.order_id:
+                metadata["order_id"] = payment_data.order_id
+            # Clients retrying a checkout send the same Idempotency-Key header
+            result = await create_payment_intent(
+                amount,
+                currency,
+                metadata,
+                idempotency_key
             )
             return result
     except Exception as e:
@@ -527,74 +1189,69 @@ async def confirm_payment_endpoint(
     order_id: str,
     user: dict = Depends(get_current_user)
 ):
+    order = await orders.find_one({"_id": ObjectId(order_id)}) if ObjectId.is_valid(order_id) else None
+    if not order or order["user_email"] != user["email"]:
+        raise HTTPException(404, "Order not found")
+    
     try:
         if STRIPE_SECRET_KEY.startswith("sk_test"):
-            payment_status = {"status": "completed", "amount": 0}
+            payment_status = {"status": "completed", "amount": order["total"],
+                              "currency": order.get("currency", ORDER_CURRENCY),
+                              "metadata": {"order_id": order_id}}
         else:
-            payment_status = confirm_payment(payment_intent_id)
-        
-        # Save payment record
-        payment_record = {
-            "order_id": order_id,
-            "user_email": user["email"],
-            "amount": payment_status["amount"],
-            "payment_intent_id": payment_intent_id,
-            "status": payment_status["status"],
-            "created_at": datetime.now()
-        }
-        await payments.insert_one(payment_record)
-        
-        # Update order payment status
-        await orders.update_one(
-            {"_id": ObjectId(order_id)},
-            {"$set": {"payment_status": PaymentStatus.COMPLETED}}
+            payment_status = await confirm_payment(payment_intent_id)
+    except Exception as e:
+        raise HTTPException(400, str(e))
+    
+    # The intent itself names the order it pays for and must cover its total
+    if payment_status.get("metadata", {}).get("order_id") != order_id:
+        raise HTTPException(400, "Payment intent does not belong to this order")
+    if not covers_order(payment_status, order):
+        raise HTTPException(400, "Payment amount does not match order total")
+    
+    try:
+        # The payment record and order update are applied by the reconciliation worker
+        await payment_reconciler.record(
+            confirmation_event(payment_intent_id, order_id, user["email"], payment_status),
+            source="confirm"
         )
         
+        if payment_status["status"] in FAILED_GATEWAY_STATUSES:
+            return {"msg": "Payment failed", "status": payment_status["status"]}
         return {"msg": "Payment confirmed", "status": payment_status["status"]}
     except Exception as e:
         raise HTTPException(400, str(e))
 
+@app.post("/payments/webhook")
+async def payment_webhook(request: Request, stripe_signature: Optional[str] = Header(None)):
+    """Gateway event delivery; events are logged here and applied in batches by the worker"""
+    payload = await request.body()
+    if STRIPE_WEBHOOK_SECRET:
+        if not verify_signature(payload, stripe_signature):
+            raise HTTPException(400, "Invalid signature")
+    elif not PAYMENT_WEBHOOK_ALLOW_UNSIGNED:
+        raise HTTPException(503, "Webhook secret not configured")
+    
+    try:
+        event = json.loads(payload)
+    except ValueError:
+        raise HTTPException(400, "Malformed event")
+    
+    try:
+        new = await payment_reconciler.record(event)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    return {"received": True, "duplicate": not new}
+
 # ========== ADMIN ANALYTICS ENDPOINTS ==========
 @app.get("/admin/analytics/sales")
 async def get_sales_stats(admin: dict = Depends(get_admin_user)):
-    total_revenue = 0.0
     total_orders = await orders.count_documents({})
     total_users = await users.count_documents({})
     total_products = await products.count_documents({"is_active": True})
     
-    revenue_by_category = {}
-    revenue_by_month = {}
-    
-    async for order in orders.find({"payment_status": "Completed"}):
-        total_revenue += order.get("total", 0)
-        
-        # Revenue by category
-        for item in order.get("items", []):
-            product = await products.find_one({"_id": ObjectId(item["product_id"])})
-            if product:
-                category = product.get("category", "Other")
-                revenue_by_category[category] = revenue_by_category.get(category, 0) + item["total"]
-        
-        # Revenue by month
-        month_key = order.get("created_at", datetime.now()).strftime("%Y-%m")
-        revenue_by_month[month_key] = revenue_by_month.get(month_key, 0) + order.get("total", 0)
-    
-    # Get top products
-    product_sales = {}
-    async for order in orders.find():
-        for item in order.get("items", []):
-            product_id = item["product_id"]
-            product_sales[product_id] = product_sales.get(product_id, 0) + item["quantity"]
-    
-    top_products = []
-    for product_id, quantity in sorted(product_sales.items(), key=lambda x: x[1], reverse=True)[:10]:
-        product = await products.find_one({"_id": ObjectId(product_id)})
-        if product:
-            top_products.append({
-                "id": str(product["_id"]),
-                "name": product["name"],
-                "sales": quantity
-            })
+    # Revenue and top products come from the buckets maintained on order/payment writes
+    rollups = await get_sales_rollups(sales_rollups)
     
     # Recent orders
     recent_orders = []
@@ -603,58 +1260,57 @@ async def get_sales_stats(admin: dict = Depends(get_admin_user)):
         recent_orders.append(order)
     
     return {
-        "total_revenue": round(total_revenue, 2),
+        "total_revenue": round(rollups["total_revenue"], 2),
         "total_orders": total_orders,
         "total_users": total_users,
         "total_products": total_products,
-        "revenue_by_category": revenue_by_category,
-        "revenue_by_month": [{"month": k, "revenue": v} for k, v in revenue_by_month.items()],
-        "top_products": top_products,
+        "revenue_by_category": rollups["revenue_by_category"],
+        "revenue_by_month": rollups["revenue_by_month"],
+        "top_products": rollups["top_products"],
         "recent_orders": recent_orders
     }
 
 @app.get("/admin/analytics/payments")
-async def get_payment_stats(admin: dict = Depends(get_admin_user)):
-    total_received = 0.0
-    pending_payments = 0.0
-    failed_payments = 0.0
-    refunded_amount = 0.0
-    payments_by_method = {}
-    payments_by_date = {}
-    
-    async for payment in payments.find():
-        amount = payment.get("amount", 0)
-        status = payment.get("status", "pending")
-        method = payment.get("payment_method", "Unknown")
-        
-        if status == "completed":
-            total_received += amount
-        elif status == "pending":
-            pending_payments += amount
-        elif status == "failed":
-            failed_payments += amount
-        elif status == "refunded":
-            refunded_amount += amount
-        
-        payments_by_method[method] = payments_by_method.get(method, 0) + amount
-        
-        date_key = payment.get("created_at", datetime.now()).strftime("%Y-%m-%d")
-        payments_by_date[date_key] = payments_by_date.get(date_key, 0) + amount
+async def get_payment_stats(
+    start_date: Optional[datetime] = Query(None),
+    end_date: Optional[datetime] = Query(None),
+    admin: dict = Depends(get_admin_user)
+):
+    totals = await get_payment_totals(payments, start_date, end_date)
+    by_status = totals["by_status"]
     
     return {
-        "total_received": round(total_received, 2),
-        "pending_payments": round(pending_payments, 2),
-        "failed_payments": round(failed_payments, 2),
-        "refunded_amount": round(refunded_amount, 2),
-        "payments_by_method": payments_by_method,
-        "payments_by_date": [{"date": k, "amount": v} for k, v in payments_by_date.items()]
+        "total_received": round(by_status.get("completed", 0.0), 2),
+        "pending_payments": round(by_status.get("pending", 0.0), 2),
+        "failed_payments": round(by_status.get("failed", 0.0), 2),
+        "refunded_amount": round(by_status.get("refunded", 0.0), 2),
+        "payments_by_method": totals["by_method"],
+        "payments_by_date": totals["by_date"]
+    }
+
+@app.get("/admin/metrics")
+async def get_metrics(admin: dict = Depends(get_admin_user)):
+    return {
+        "password_hashing": hashing_stats(),
+        "token_cache": token_cache_stats(),
+        "profile_cache": profile_cache.stats(),
+        "coupon_cache": coupon_cache_stats(),
+        "catalog_cache": catalog_cache.stats(),
+        "tracking_streams": tracking_hub.stats(),
+        "cart_pricing": pricing_cache_stats(),
+        "payment_gateway": payment_gateway_stats(),
+        "payment_reconciliation": payment_reconciler.stats()
     }
 
 @app.get("/admin/orders/tracking")
-async def get_all_tracking(admin: dict = Depends(get_admin_user)):
-    result = []
-    async for tracker in shipping_trackers.find():
-        tracker["_id"] = str(tracker["_id"])
-        result.append(tracker)
-    return result
+async def get_all_tracking(
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None),
+    stream: bool = Query(False),
+    admin: dict = Depends(get_admin_user)
+):
+    if stream:
+        return streamed_listing(shipping_trackers.find())
+    return await paged_listing(shipping_trackers, {}, limit, cursor, response)
 
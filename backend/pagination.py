@@ -0,0 +1,67 @@
+import base64
+import json
+from typing import Iterable, Optional
+from bson import ObjectId
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+def encode_cursor(last_id, score: Optional[float] = None) -> str:
+    """Encode the sort key of the last returned document as an opaque cursor"""
+    data = {"id": str(last_id)}
+    if score is not None:
+        data["score"] = score
+    raw = json.dumps(data, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> dict:
+    """Decode a cursor produced by encode_cursor, raising ValueError if malformed"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        data["id"] = ObjectId(data["id"])
+        if "score" in data:
+            data["score"] = float(data["score"])
+        return data
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+def build_projection(fields: Optional[str], hidden: Iterable[str] = ()) -> Optional[dict]:
+    """Turn a comma separated field list into a MongoDB projection.
+    
+    Fields in hidden (and their subfields) are never included.
+    """
+    if not fields:
+        return None
+    projection = {}
+    for f in fields.split(","):
+        f = f.strip()
+        if f and not any(f == h or f.startswith(h + ".") for h in hidden):
+            projection[f] = 1
+    return projection or None
+
+def keyset_filter(cursor: Optional[dict], with_score: bool = False,
+                  descending: bool = False) -> dict:
+    """Filter selecting documents that sort after the cursor position.
+
+    Plain listings sort by _id (ascending unless descending is set); text
+    searches sort by relevance score descending with _id as the tie breaker.
+    """
+    if not cursor:
+        return {}
+    if with_score and "score" in cursor:
+        return {"$or": [
+            {"score": {"$lt": cursor["score"]}},
+            {"score": cursor["score"], "_id": {"$gt": cursor["id"]}}
+        ]}
+    return {"_id": {"$lt" if descending else "$gt": cursor["id"]}}
+
+async def fetch_page(collection, query: dict, limit: int, cursor: Optional[str] = None,
+                     descending: bool = False, projection: Optional[dict] = None):
+    """Return (documents, next_cursor) for one keyset page ordered by _id"""
+    position = decode_cursor(cursor) if cursor else None
+    page_query = {**query, **keyset_filter(position, descending=descending)}
+    find_cursor = collection.find(page_query, projection).sort("_id", -1 if descending else 1)
+    docs = await find_cursor.limit(limit).to_list(limit)
+    next_cursor = encode_cursor(docs[-1]["_id"]) if len(docs) == limit else None
+    return docs, next_cursor
@@ -1,58 +1,175 @@
-import stripe
+import asyncio
+import random
+import uuid
+from urllib.parse import urlencode
 from typing import Optional
 import os
+import httpx
 
 # Initialize Stripe (use test keys for development)
 STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY", "sk_test_your_stripe_secret_key")
 STRIPE_PUBLISHABLE_KEY = os.getenv("STRIPE_PUBLISHABLE_KEY", "pk_test_your_stripe_publishable_key")
 
-stripe.api_key = STRIPE_SECRET_KEY
+# Point at payment_sandbox.py (e.g. http://localhost:12111) to test without Stripe
+PAYMENT_GATEWAY_URL = os.getenv("PAYMENT_GATEWAY_URL", "https://api.stripe.com")
+PAYMENT_TIMEOUT_SECONDS = float(os.getenv("PAYMENT_TIMEOUT_SECONDS", "10"))
+PAYMENT_MAX_RETRIES = int(os.getenv("PAYMENT_MAX_RETRIES", "3"))
+PAYMENT_MAX_CONNECTIONS = int(os.getenv("PAYMENT_MAX_CONNECTIONS", "20"))
 
-def create_payment_intent(amount: float, currency: str = "INR", metadata: dict = None):
+RETRYABLE_STATUSES = {409, 429, 500, 502, 503, 504}
+
+class PaymentError(Exception):
+    pass
+
+def form_encode(data: dict, prefix: str = "") -> list:
+    """Flatten nested dicts/lists into Stripe's bracketed form fields"""
+    fields = []
+    for key, value in data.items():
+        name = f"{prefix}[{key}]" if prefix else key
+        if isinstance(value, dict):
+            fields.extend(form_encode(value, name))
+        elif isinstance(value, (list, tuple)):
+            fields.extend((f"{name}[]", str(v)) for v in value)
+        elif value is not None:
+            fields.append((name, str(value)))
+    return fields
+
+class PaymentGateway:
+    """Async Stripe-compatible client sharing one pooled connection set.
+
+    Failed network calls and retryable statuses are retried with jittered
+    exponential backoff. Every POST carries an idempotency key that stays
+    the same across its retries, so a retried charge is never applied twice.
+    """
+
+    def __init__(self, base_url: str, api_key: str, timeout: float = PAYMENT_TIMEOUT_SECONDS,
+                 max_retries: int = PAYMENT_MAX_RETRIES, max_connections: int = PAYMENT_MAX_CONNECTIONS):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.max_connections = max_connections
+        self._client = None
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Created lazily so it binds to the running event loop
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                auth=(self.api_key, ""),
+                timeout=httpx.Timeout(self.timeout, connect=min(self.timeout, 5.0)),
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections
+                )
+            )
+        return self._client
+
+    async def request(self, method: str, path: str, data: Optional[dict] = None,
+                      idempotency_key: Optional[str] = None) -> dict:
+        headers = {}
+        if method == "POST":
+            headers["Idempotency-Key"] = idempotency_key or str(uuid.uuid4())
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        body = urlencode(form_encode(data)) if data else None
+
+        for attempt in range(self.max_retries + 1):
+            self.requests += 1
+            try:
+                response = await self.client.request(method, path, content=body, headers=headers)
+            except httpx.TransportError as e:
+                error = f"{type(e).__name__}: {e}"
+            else:
+                if response.status_code < 400:
+                    return response.json()
+                try:
+                    error = response.json()["error"]["message"]
+                except Exception:
+                    error = f"HTTP {response.status_code}"
+                if response.status_code not in RETRYABLE_STATUSES:
+                    self.failures += 1
+                    raise PaymentError(error)
+
+            if attempt < self.max_retries:
+                self.retries += 1
+                await asyncio.sleep(min(0.25 * 2 ** attempt, 4.0) * random.uniform(0.5, 1.0))
+
+        self.failures += 1
+        raise PaymentError(f"Payment gateway unavailable after {self.max_retries + 1} attempts: {error}")
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self) -> dict:
+        return {
+            "base_url": self.base_url,
+            "requests": self.requests,
+            "retries": self.retries,
+            "failures": self.failures
+        }
+
+gateway = PaymentGateway(PAYMENT_GATEWAY_URL, STRIPE_SECRET_KEY)
+
+async def create_payment_intent(amount: float, currency: str = "INR", metadata: dict = None,
+                                idempotency_key: Optional[str] = None):
     """Create a Stripe payment intent"""
     try:
-        intent = stripe.PaymentIntent.create(
-            amount=int(amount * 100),  # Convert to cents/paisa
-            currency=currency.lower(),
-            metadata=metadata or {},
-            payment_method_types=["card"],
-        )
+        intent = await gateway.request("POST", "/v1/payment_intents", {
+            "amount": int(round(amount * 100)),  # Convert to cents/paisa
+            "currency": currency.lower(),
+            "metadata": metadata or {},
+            "payment_method_types": ["card"],
+        }, idempotency_key)
         return {
-            "client_secret": intent.client_secret,
-            "payment_intent_id": intent.id,
-            "status": intent.status
+            "client_secret": intent["client_secret"],
+            "payment_intent_id": intent["id"],
+            "status": intent["status"]
         }
     except Exception as e:
         raise Exception(f"Payment intent creation failed: {str(e)}")
 
-def confirm_payment(payment_intent_id: str):
+async def confirm_payment(payment_intent_id: str):
     """Confirm a payment"""
     try:
-        intent = stripe.PaymentIntent.retrieve(payment_intent_id)
+        intent = await gateway.request("GET", f"/v1/payment_intents/{payment_intent_id}")
         return {
-            "status": intent.status,
-            "amount": intent.amount / 100,
-            "currency": intent.currency.upper()
+            "status": intent["status"],
+            "amount": intent["amount"] / 100,
+            "currency": intent["currency"].upper(),
+            "metadata": intent.get("metadata") or {}
         }
     except Exception as e:
         raise Exception(f"Payment confirmation failed: {str(e)}")
 
-def create_refund(payment_intent_id: str, amount: Optional[float] = None):
+async def create_refund(payment_intent_id: str, amount: Optional[float] = None,
+                        idempotency_key: Optional[str] = None):
     """Create a refund"""
     try:
         refund_data = {"payment_intent": payment_intent_id}
         if amount:
-            refund_data["amount"] = int(amount * 100)
-        
-        refund = stripe.Refund.create(**refund_data)
+            refund_data["amount"] = int(round(amount * 100))
+
+        refund = await gateway.request("POST", "/v1/refunds", refund_data, idempotency_key)
         return {
-            "refund_id": refund.id,
-            "amount": refund.amount / 100,
-            "status": refund.status
+            "refund_id": refund["id"],
+            "amount": refund["amount"] / 100,
+            "status": refund["status"]
         }
     except Exception as e:
         raise Exception(f"Refund failed: {str(e)}")
 
+async def close_payment_gateway():
+    await gateway.close()
+
+def payment_gateway_stats() -> dict:
+    return gateway.stats()
+
 # Mock payment processor for development (when Stripe keys are not set)
 def mock_payment(amount: float, payment_method: str):
     """Mock payment processor for development"""
@@ -61,4 +178,3 @@ def mock_payment(amount: float, payment_method: str):
         "status": "completed",
         "amount": amount
     }
-
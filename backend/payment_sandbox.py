@@ -0,0 +1,114 @@
+"""Local stand-in for the Stripe endpoints used by payment.py.
+
+Run it with `uvicorn payment_sandbox:app --port 12111` and start the backend
+with PAYMENT_GATEWAY_URL=http://localhost:12111 and any non-test
+STRIPE_SECRET_KEY. SANDBOX_LATENCY_MS and SANDBOX_FAILURE_RATE inject delay
+and 503s so timeouts and retries can be exercised.
+"""
+import asyncio
+import os
+import random
+import uuid
+from fastapi import FastAPI, Request, Header
+from fastapi.responses import JSONResponse
+from typing import Optional
+
+SANDBOX_LATENCY_MS = float(os.getenv("SANDBOX_LATENCY_MS", "0"))
+SANDBOX_FAILURE_RATE = float(os.getenv("SANDBOX_FAILURE_RATE", "0"))
+SANDBOX_INTENT_STATUS = os.getenv("SANDBOX_INTENT_STATUS", "succeeded")
+
+app = FastAPI(title="Payment Gateway Sandbox")
+
+intents = {}
+refunds = {}
+idempotent_responses = {}
+counters = {"requests": 0, "injected_failures": 0, "idempotent_replays": 0}
+
+def error(status: int, message: str):
+    return JSONResponse({"error": {"message": message}}, status_code=status)
+
+def parse_form(fields) -> dict:
+    """Undo Stripe's bracketed form encoding (one level of nesting, [] lists)"""
+    data = {}
+    for name, value in fields.multi_items():
+        if name.endswith("[]"):
+            data.setdefault(name[:-2], []).append(value)
+        elif "[" in name:
+            outer, inner = name[:-1].split("[", 1)
+            data.setdefault(outer, {})[inner] = value
+        else:
+            data[name] = value
+    return data
+
+@app.middleware("http")
+async def inject_faults(request: Request, call_next):
+    if request.url.path.startswith("/sandbox"):
+        return await call_next(request)
+    counters["requests"] += 1
+    if SANDBOX_LATENCY_MS:
+        await asyncio.sleep(SANDBOX_LATENCY_MS / 1000)
+    if not request.headers.get("authorization"):
+        return error(401, "No API key provided")
+    if random.random() < SANDBOX_FAILURE_RATE:
+        counters["injected_failures"] += 1
+        return error(503, "Injected failure")
+    return await call_next(request)
+
+async def idempotent(key: Optional[str], create):
+    if key and key in idempotent_responses:
+        counters["idempotent_replays"] += 1
+        return idempotent_responses[key]
+    result = create()
+    if key:
+        idempotent_responses[key] = result
+    return result
+
+@app.post("/v1/payment_intents")
+async def create_intent(request: Request, idempotency_key: Optional[str] = Header(None)):
+    data = parse_form(await request.form())
+    if "amount" not in data or "currency" not in data:
+        return error(400, "amount and currency are required")
+
+    def create():
+        intent_id = f"pi_{uuid.uuid4().hex[:24]}"
+        intents[intent_id] = {
+            "id": intent_id,
+            "object": "payment_intent",
+            "amount": int(data["amount"]),
+            "currency": data["currency"],
+            "metadata": data.get("metadata", {}),
+            "payment_method_types": data.get("payment_method_types", ["card"]),
+            "client_secret": f"{intent_id}_secret_{uuid.uuid4().hex[:12]}",
+            "status": SANDBOX_INTENT_STATUS
+        }
+        return intents[intent_id]
+    return await idempotent(idempotency_key, create)
+
+@app.get("/v1/payment_intents/{intent_id}")
+async def retrieve_intent(intent_id: str):
+    if intent_id not in intents:
+        return error(404, f"No such payment_intent: '{intent_id}'")
+    return intents[intent_id]
+
+@app.post("/v1/refunds")
+async def create_refund(request: Request, idempotency_key: Optional[str] = Header(None)):
+    data = parse_form(await request.form())
+    intent = intents.get(data.get("payment_intent"))
+    if not intent:
+        return error(404, "No such payment_intent")
+
+    def create():
+        refund_id = f"re_{uuid.uuid4().hex[:24]}"
+        refunds[refund_id] = {
+            "id": refund_id,
+            "object": "refund",
+            "payment_intent": intent["id"],
+            "amount": int(data.get("amount", intent["amount"])),
+            "status": "succeeded"
+        }
+        return refunds[refund_id]
+    return await idempotent(idempotency_key, create)
+
+@app.get("/sandbox/stats")
+async def sandbox_stats():
+    return {**counters, "intents": len(intents), "refunds": len(refunds)}
@@ -0,0 +1,89 @@
+import hashlib
+import os
+import numpy as np
+from cache import LRUCache
+from discount_engine import apply_discount_many
+from loaders import load_products
+
+TAX_RATE = float(os.getenv("TAX_RATE", "0"))
+PRICING_FIELDS = {"name": 1, "price": 1, "images": 1, "discount_percent": 1, "is_active": 1}
+
+# Priced carts keyed by (user, cart contents, catalog generation)
+_priced_carts = LRUCache(maxsize=int(os.getenv("PRICING_CACHE_SIZE", "10000")), ttl=300)
+
+def cart_version(lines) -> str:
+    """Digest of a cart's lines (id, product, quantity), independent of line order"""
+    entries = sorted(
+        (str(line.get("_id", "")), line["product_id"], int(line["quantity"])) for line in lines
+    )
+    return hashlib.sha1(repr(entries).encode()).hexdigest()
+
+async def price_lines(lines, products_collection) -> dict:
+    """Price every line from current catalog data in one query and one vectorized pass.
+    
+    Lines whose product is missing or inactive are listed under "unavailable".
+    Raises ValueError for a line quantity below 1.
+    """
+    for line in lines:
+        if line["quantity"] < 1:
+            raise ValueError(f"Invalid quantity for product {line['product_id']}")
+    product_map = await load_products(
+        [line["product_id"] for line in lines], products_collection, PRICING_FIELDS
+    )
+    available = []
+    unavailable = []
+    for line in lines:
+        product = product_map.get(line["product_id"])
+        if product and product.get("is_active", True):
+            available.append((line, product))
+        else:
+            unavailable.append(line["product_id"])
+    
+    items = []
+    subtotal = 0.0
+    if available:
+        unit_prices = apply_discount_many(
+            [p["price"] for _, p in available],
+            [p.get("discount_percent", 0) for _, p in available]
+        )
+        quantities = np.array([line["quantity"] for line, _ in available], dtype=np.float64)
+        line_totals = np.round(unit_prices * quantities, 2)
+        subtotal = float(line_totals.sum())
+        for (line, product), unit_price, line_total in zip(available, unit_prices, line_totals):
+            items.append({
+                "line_id": line.get("_id"),
+                "product_id": line["product_id"],
+                "product_name": product["name"],
+                "images": product.get("images", []),
+                "list_price": product["price"],
+                "price": round(float(unit_price), 2),
+                "quantity": line["quantity"],
+                "total": float(line_total)
+            })
+    
+    return {"items": items, "subtotal": round(subtotal, 2), "unavailable": unavailable}
+
+async def price_cart(user_email: str, lines, products_collection, catalog_version) -> dict:
+    """price_lines, reused while the cart contents and catalog are unchanged"""
+    key = (user_email, cart_version(lines), catalog_version)
+    priced = _priced_carts.get(key)
+    if priced is None:
+        priced = await price_lines(lines, products_collection)
+        _priced_carts.set(key, priced)
+    return priced
+
+def order_totals(subtotal: float, discount: float = 0.0, shipping_cost: float = 0.0,
+                 tax_rate: float = TAX_RATE) -> dict:
+    """Final amounts for an order; tax applies to the discounted subtotal"""
+    taxable = max(subtotal - discount, 0.0)
+    tax = round(taxable * tax_rate, 2)
+    return {
+        "subtotal": round(subtotal, 2),
+        "discount": round(discount, 2),
+        "shipping_cost": round(shipping_cost, 2),
+        "tax": tax,
+        "total": round(taxable + shipping_cost + tax, 2)
+    }
+
+def pricing_cache_stats() -> dict:
+    return _priced_carts.stats()
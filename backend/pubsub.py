@@ -0,0 +1,43 @@
+import asyncio
+from typing import Dict, Set
+
+class TrackingHub:
+    """In-process fan-out of tracking updates to subscribed clients.
+    
+    Each subscriber gets a bounded queue; a slow client loses its oldest
+    updates rather than holding up publishers.
+    """
+    
+    def __init__(self, queue_size: int = 100):
+        self.queue_size = queue_size
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self.published = 0
+        self.dropped = 0
+    
+    def subscribe(self, tracking_number: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.setdefault(tracking_number, set()).add(queue)
+        return queue
+    
+    def unsubscribe(self, tracking_number: str, queue: asyncio.Queue):
+        queues = self._subscribers.get(tracking_number)
+        if queues:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[tracking_number]
+    
+    def publish(self, tracking_number: str, event: dict):
+        for queue in self._subscribers.get(tracking_number, ()):
+            if queue.full():
+                queue.get_nowait()
+                self.dropped += 1
+            queue.put_nowait(event)
+            self.published += 1
+    
+    def stats(self) -> dict:
+        return {
+            "shipments": len(self._subscribers),
+            "subscribers": sum(len(q) for q in self._subscribers.values()),
+            "published": self.published,
+            "dropped": self.dropped
+        }
@@ -0,0 +1,390 @@
+import asyncio
+import hashlib
+import hmac
+import os
+import time
+from datetime import datetime
+from typing import Optional
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from analytics import record_payment_completed, record_payment_reversed
+from inventory import release_stock, settle_paid_stock
+
+RECONCILE_BATCH_SIZE = int(os.getenv("RECONCILE_BATCH_SIZE", "500"))
+RECONCILE_POLL_SECONDS = float(os.getenv("RECONCILE_POLL_SECONDS", "5"))
+STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET", "")
+# Local development only: accept webhooks without a signature when no secret is set
+PAYMENT_WEBHOOK_ALLOW_UNSIGNED = os.getenv("PAYMENT_WEBHOOK_ALLOW_UNSIGNED", "") == "1"
+WEBHOOK_TOLERANCE_SECONDS = 300
+
+# Gateway event type -> payment record status; other event types are logged and skipped
+EVENT_STATUSES = {
+    "payment_intent.processing": "pending",
+    "payment_intent.succeeded": "completed",
+    "payment_intent.payment_failed": "failed",
+    "payment_intent.canceled": "failed",
+    "charge.refunded": "refunded",
+}
+# Only a canceled intent is final; after a failed attempt the customer can retry it
+FINAL_EVENT_TYPES = {"payment_intent.canceled"}
+# Tie breaker when two events for one payment share a timestamp
+STATUS_RANK = {"pending": 0, "failed": 1, "completed": 2, "refunded": 3}
+FAILED_GATEWAY_STATUSES = {"failed", "canceled", "requires_payment_method"}
+# Orders carry no currency field; they are priced in this one
+ORDER_CURRENCY = "INR"
+
+def check_event(event) -> dict:
+    """Raise ValueError unless the event has the fields the log and worker rely on"""
+    if not isinstance(event, dict) or not isinstance(event.get("id"), str) or not event["id"]:
+        raise ValueError("Event id is required")
+    if not isinstance(event.get("type"), str):
+        raise ValueError("Event type is required")
+    if not isinstance(event.get("data"), dict) or not isinstance(event["data"].get("object"), dict):
+        raise ValueError("Event data.object is required")
+    created = event.get("created")
+    if created is not None and (isinstance(created, bool) or not isinstance(created, (int, float))
+                                or not 0 <= created < 2 ** 33):
+        raise ValueError("Event created must be a unix timestamp")
+    return event
+
+def verify_signature(payload: bytes, header: Optional[str], secret: str = STRIPE_WEBHOOK_SECRET,
+                     tolerance: int = WEBHOOK_TOLERANCE_SECONDS) -> bool:
+    """Check a Stripe-Signature header (t=<ts>,v1=<hmac-sha256 of "ts.payload">)"""
+    if not header:
+        return False
+    parts = {}
+    for item in header.split(","):
+        key, _, value = item.partition("=")
+        parts.setdefault(key.strip(), []).append(value.strip())
+    try:
+        timestamp = int(parts["t"][0])
+    except (KeyError, ValueError):
+        return False
+    if abs(time.time() - timestamp) > tolerance:
+        return False
+    expected = hmac.new(secret.encode(), f"{timestamp}.".encode() + payload, hashlib.sha256).hexdigest()
+    return any(hmac.compare_digest(expected, sig) for sig in parts.get("v1", []))
+
+def confirmation_event(payment_intent_id: str, order_id: str, user_email: str, result: dict) -> dict:
+    """Gateway-shaped event for a client-side confirmation, so it goes through the same log"""
+    status = result["status"]
+    if status in ("succeeded", "completed"):
+        event_type = "payment_intent.succeeded"
+    elif status == "canceled":
+        event_type = "payment_intent.canceled"
+    elif status in FAILED_GATEWAY_STATUSES:
+        event_type = "payment_intent.payment_failed"
+    else:
+        event_type = "payment_intent.processing"
+    return {
+        "id": f"confirm_{payment_intent_id}_{order_id}_{status}",
+        "type": event_type,
+        "created": int(time.time()),
+        "data": {"object": {
+            "id": payment_intent_id,
+            "amount": int(round(result.get("amount", 0) * 100)),
+            "currency": result.get("currency", "INR").lower(),
+            "status": status,
+            "metadata": {"order_id": order_id, "user_email": user_email}
+        }}
+    }
+
+def payment_change(event: dict) -> Optional[dict]:
+    """The payment state an event asserts, or None for event types we don't act on"""
+    status = EVENT_STATUSES.get(event.get("type"))
+    if status is None:
+        return None
+    obj = event["data"]["object"]
+    if event["type"].startswith("charge."):
+        intent_id = obj.get("payment_intent")
+        amount = obj.get("amount_refunded", obj.get("amount", 0))
+    else:
+        intent_id = obj.get("id")
+        amount = obj.get("amount_received") or obj.get("amount", 0)
+    metadata = obj.get("metadata") or {}
+    return {
+        "payment_intent_id": intent_id,
+        "order_id": metadata.get("order_id"),
+        "user_email": metadata.get("user_email"),
+        "status": status,
+        "gateway_status": obj.get("status"),
+        "amount": amount / 100,
+        "currency": (obj.get("currency") or "inr").upper(),
+        "event_id": event["id"],
+        "created": event.get("created") or 0,
+        "final": event["type"] in FINAL_EVENT_TYPES
+    }
+
+def covers_order(payment: dict, order: Optional[dict]) -> bool:
+    """Whether a payment's amount and currency exactly match an order's total"""
+    return (bool(order)
+            and (payment.get("currency") or "").upper() == order.get("currency", ORDER_CURRENCY).upper()
+            and abs(payment["amount"] - order["total"]) < 0.005)
+
+def change_rank(change: dict) -> tuple:
+    """Order of two changes to one payment: gateway time, then status precedence"""
+    return (change["created"], STATUS_RANK[change["status"]])
+
+def newer_than_stored(change: dict) -> dict:
+    """Filter matching a payment record only if this change is not older than its last one"""
+    created, rank = change_rank(change)
+    return {"$or": [
+        {"event_created": {"$exists": False}},
+        {"event_created": {"$lt": created}},
+        {"event_created": created, "status_rank": {"$lte": rank}}
+    ]}
+
+class PaymentReconciler:
+    """Applies logged gateway events to payments and orders in batches.
+
+    Events are appended to the log keyed by their gateway id, so redelivered
+    webhooks are dropped on insert. The worker reads unprocessed events in
+    arrival order, keeps the newest change per payment, and applies each
+    batch with bulk writes. Payment records keep the gateway time and status
+    rank of the event last applied, and only newer events overwrite them, so
+    out-of-order delivery, crashes and replays cannot move a payment back.
+    A succeeded payment settles its order only if it covers the order's
+    total; otherwise the payment record is flagged needs_review.
+    """
+
+    def __init__(self, events, payments, orders, products, reservations, rollups,
+                 batch_size: int = RECONCILE_BATCH_SIZE):
+        self.events = events
+        self.payments = payments
+        self.orders = orders
+        self.products = products
+        self.reservations = reservations
+        self.rollups = rollups
+        self.batch_size = batch_size
+        self._wakeup = asyncio.Event()
+        self.received = 0
+        self.duplicates = 0
+        self.processed = 0
+        self.batches = 0
+        self.mismatched = 0
+        self.busy_seconds = 0.0
+
+    async def record(self, event: dict, source: str = "webhook") -> bool:
+        """Append an event to the log; False if this event id was already received.
+        
+        Raises ValueError for a malformed event.
+        """
+        check_event(event)
+        try:
+            await self.events.insert_one({
+                "_id": event["id"],
+                "type": event.get("type"),
+                "created": datetime.fromtimestamp(event.get("created") or time.time()),
+                "source": source,
+                "payload": event,
+                "received_at": datetime.now(),
+                "processed_at": None
+            })
+        except DuplicateKeyError:
+            self.duplicates += 1
+            return False
+        self.received += 1
+        self._wakeup.set()
+        return True
+
+    async def process_batch(self) -> int:
+        """Apply up to batch_size pending events; returns how many were consumed"""
+        started = time.perf_counter()
+        batch = await self.events.find({"processed_at": None}).sort("received_at", 1) \
+            .limit(self.batch_size).to_list(self.batch_size)
+        if not batch:
+            return 0
+
+        # Newest change per (payment, order); later events supersede earlier ones
+        latest = {}
+        for doc in batch:
+            change = payment_change(doc["payload"])
+            if not change or not change["payment_intent_id"]:
+                continue
+            key = (change["payment_intent_id"], change["order_id"])
+            rank = change_rank(change)
+            if key not in latest or rank >= latest[key][0]:
+                latest[key] = (rank, change)
+        changes = [change for _, change in latest.values()]
+        await self._resolve_orders(changes)
+        changes = [c for c in changes if c["order_id"] and ObjectId.is_valid(c["order_id"])]
+
+        if changes:
+            await self._apply(changes)
+        await self.events.update_many(
+            {"_id": {"$in": [doc["_id"] for doc in batch]}},
+            {"$set": {"processed_at": datetime.now()}}
+        )
+        self.processed += len(batch)
+        self.batches += 1
+        self.busy_seconds += time.perf_counter() - started
+        return len(batch)
+
+    async def _resolve_orders(self, changes: list):
+        """Fill in order ids for events whose metadata lacks one (e.g. refunds)"""
+        missing = {c["payment_intent_id"] for c in changes if not c["order_id"]}
+        if not missing:
+            return
+        known = {}
+        async for payment in self.payments.find(
+            {"payment_intent_id": {"$in": list(missing)}},
+            {"payment_intent_id": 1, "order_id": 1, "user_email": 1}
+        ):
+            known[payment["payment_intent_id"]] = payment
+        for change in changes:
+            payment = known.get(change["payment_intent_id"])
+            if not change["order_id"] and payment:
+                change["order_id"] = payment["order_id"]
+                change["user_email"] = change["user_email"] or payment.get("user_email")
+
+    async def _apply(self, changes: list):
+        now = datetime.now()
+        # A succeeded intent settles its order only if it paid that order's total
+        paid_ids = [ObjectId(c["order_id"]) for c in changes if c["status"] == "completed"]
+        order_totals = {}
+        if paid_ids:
+            async for order in self.orders.find({"_id": {"$in": paid_ids}}, {"total": 1, "currency": 1}):
+                order_totals[str(order["_id"])] = order
+        mismatched = {
+            c["order_id"] for c in changes
+            if c["status"] == "completed" and not covers_order(c, order_totals.get(c["order_id"]))
+        }
+        if mismatched:
+            self.mismatched += len(mismatched)
+            print(f"Warning: payments left for review, amount does not match order: {sorted(mismatched)}")
+
+        # Create missing records first, then overwrite only where this change is newer
+        payment_inserts = []
+        payment_writes = []
+        for c in changes:
+            key = {"payment_intent_id": c["payment_intent_id"], "order_id": c["order_id"]}
+            fields = {
+                "status": c["status"],
+                "status_rank": STATUS_RANK[c["status"]],
+                "event_created": c["created"],
+                "gateway_status": c["gateway_status"],
+                "amount": c["amount"],
+                "currency": c["currency"],
+                "last_event_id": c["event_id"],
+                "needs_review": c["status"] == "completed" and c["order_id"] in mismatched,
+                "updated_at": now
+            }
+            on_insert = {"created_at": datetime.fromtimestamp(c["created"]) if c["created"] else now}
+            if c["user_email"]:
+                on_insert["user_email"] = c["user_email"]
+            payment_inserts.append(UpdateOne(key, {"$setOnInsert": {**fields, **on_insert}}, upsert=True))
+            payment_writes.append(UpdateOne({**key, **newer_than_stored(c)}, {"$set": fields}))
+
+        # Tag orders this batch moves to Completed so exactly those get rollups and stock commits
+        batch_id = ObjectId()
+        settled = {"$nin": ["Completed", "Refunded"]}
+        order_writes = []
+        paid, released, refunded = [], [], []
+        for c in changes:
+            order_id = ObjectId(c["order_id"])
+            if c["status"] == "completed":
+                if c["order_id"] in mismatched:
+                    continue
+                paid.append(order_id)
+                order_writes.append(UpdateOne(
+                    {"_id": order_id, "payment_status": settled},
+                    {"$set": {"payment_status": "Completed", "payment_batch": batch_id}}
+                ))
+            elif c["status"] == "failed":
+                if c["final"]:
+                    released.append(c["order_id"])
+                order_writes.append(UpdateOne(
+                    {"_id": order_id, "payment_status": settled},
+                    {"$set": {"payment_status": "Failed"}}
+                ))
+            elif c["status"] == "refunded":
+                # Exactly one of these matches; paid orders are tagged so their revenue is taken back
+                refunded.append(order_id)
+                order_writes.append(UpdateOne(
+                    {"_id": order_id, "payment_status": "Completed"},
+                    {"$set": {"payment_status": "Refunded", "refund_batch": batch_id}}
+                ))
+                order_writes.append(UpdateOne(
+                    {"_id": order_id, "payment_status": {"$nin": ["Completed", "Refunded"]}},
+                    {"$set": {"payment_status": "Refunded"}}
+                ))
+
+        try:
+            await self.payments.bulk_write(payment_inserts, ordered=False)
+        except BulkWriteError as e:
+            # Another worker inserted the same record first; the guarded update below still applies
+            if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])) \
+                    or e.details.get("writeConcernErrors"):
+                raise
+        writes = [self.payments.bulk_write(payment_writes, ordered=False)]
+        if order_writes:
+            writes.append(self.orders.bulk_write(order_writes, ordered=False))
+        await asyncio.gather(*writes)
+
+        follow_up = [release_stock(order_id, self.products, self.reservations) for order_id in released]
+        if paid:
+            async for order in self.orders.find({"_id": {"$in": paid}, "payment_batch": batch_id}):
+                follow_up.append(record_payment_completed(order, self.rollups, self.products))
+                follow_up.append(
+                    settle_paid_stock(order, self.products, self.reservations, self.orders)
+                )
+        if refunded:
+            async for order in self.orders.find({"_id": {"$in": refunded}, "refund_batch": batch_id}):
+                follow_up.append(record_payment_reversed(order, self.rollups, self.products))
+        if follow_up:
+            await asyncio.gather(*follow_up)
+
+    async def drain(self) -> int:
+        """Process batches until the log has no pending events"""
+        total = 0
+        while True:
+            count = await self.process_batch()
+            total += count
+            if count < self.batch_size:
+                return total
+
+    def wake(self):
+        self._wakeup.set()
+
+    async def run(self, poll_seconds: float = RECONCILE_POLL_SECONDS):
+        """Background loop: drain on every new event, and poll to pick up replays"""
+        while True:
+            self._wakeup.clear()
+            try:
+                await self.drain()
+            except Exception as e:
+                print(f"Warning: payment reconciliation failed: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    def stats(self) -> dict:
+        return {
+            "events_received": self.received,
+            "duplicates_dropped": self.duplicates,
+            "events_processed": self.processed,
+            "batches": self.batches,
+            "amount_mismatches": self.mismatched,
+            "events_per_second": round(self.processed / self.busy_seconds, 1) if self.busy_seconds else None
+        }
+
+async def replay_events(events_collection, since: Optional[datetime] = None) -> int:
+    """Mark logged events (optionally only those created since a date) for reprocessing"""
+    query = {"created": {"$gte": since}} if since else {}
+    result = await events_collection.update_many(query, {"$set": {"processed_at": None}})
+    return result.modified_count
+
+if __name__ == "__main__":
+    import sys
+    from database import payment_events
+
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if command == "replay":
+        since = datetime.fromisoformat(sys.argv[2]) if len(sys.argv) > 2 else None
+        count = asyncio.run(replay_events(payment_events, since))
+        print(f"[OK] {count} payment events queued for reprocessing")
+    else:
+        print("Usage: python reconciliation.py replay [since-iso-date]")
+        sys.exit(1)
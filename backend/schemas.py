@@ -1,4 +1,4 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, conint
 from typing import List, Optional
 from datetime import datetime
 from enum import Enum
@@ -83,6 +83,7 @@ class ProductSchema(BaseModel):
     specifications: dict = {}
     rating: float = 0.0
     reviews_count: int = 0
+    discount_percent: int = 0
     is_featured: bool = False
     is_active: bool = True
 
@@ -97,14 +98,23 @@ class ProductUpdateSchema(BaseModel):
     stock: Optional[int] = None
     images: Optional[List[str]] = None
     specifications: Optional[dict] = None
+    discount_percent: Optional[int] = None
     is_featured: Optional[bool] = None
     is_active: Optional[bool] = None
 
 # Cart Schemas
 class CartItemSchema(BaseModel):
     product_id: str
-    quantity: int
-    price: float
+    quantity: conint(gt=0)
+    price: Optional[float] = None  # Ignored; prices come from the catalog
+
+class CartLineSchema(BaseModel):
+    product_id: str
+    quantity: conint(ge=0)  # 0 removes the line
+
+class CartBulkSchema(BaseModel):
+    items: List[CartLineSchema]
+    mode: str = "replace"  # replace or merge
 
 class CartSchema(BaseModel):
     items: List[CartItemSchema] = []
@@ -132,21 +142,22 @@ class CouponApplySchema(BaseModel):
 # Order Schemas
 class OrderItemSchema(BaseModel):
     product_id: str
-    product_name: str
-    quantity: int
-    price: float
-    total: float
+    product_name: Optional[str] = None
+    quantity: conint(gt=0)
+    price: float = 0.0
+    total: float = 0.0
 
 class OrderSchema(BaseModel):
     user_email: str
     items: List[OrderItemSchema]
     shipping_address: AddressSchema
     billing_address: Optional[AddressSchema] = None
-    subtotal: float
+    # Amounts below are recomputed by the server; client values are ignored
+    subtotal: float = 0.0
     shipping_cost: float = 0.0
     discount: float = 0.0
     tax: float = 0.0
-    total: float
+    total: float = 0.0
     coupon_code: Optional[str] = None
     payment_method: PaymentMethod
     payment_status: PaymentStatus = PaymentStatus.PENDING
@@ -169,6 +180,9 @@ class ShippingLocationSchema(BaseModel):
     status: str
     description: Optional[str] = None
 
+class TrackingEventSchema(ShippingLocationSchema):
+    tracking_number: str
+
 class ShippingTrackerSchema(BaseModel):
     order_id: str
     tracking_number: str
@@ -176,6 +190,23 @@ class ShippingTrackerSchema(BaseModel):
     history: List[ShippingLocationSchema] = []
     estimated_delivery: Optional[datetime] = None
 
+class WarehouseSchema(BaseModel):
+    name: str
+    latitude: float
+    longitude: float
+    address: Optional[str] = None
+    is_active: bool = True
+
+class ShippingRouteSchema(BaseModel):
+    destination_latitude: float
+    destination_longitude: float
+    origin_latitude: Optional[float] = None
+    origin_longitude: Optional[float] = None
+    weight_kg: float = 1.0
+
+class ShippingQuoteSchema(BaseModel):
+    routes: List[ShippingRouteSchema]
+
 # Payment Schemas
 class PaymentSchema(BaseModel):
     order_id: str
@@ -188,6 +219,7 @@ class PaymentIntentSchema(BaseModel):
     amount: float
     currency: str = "INR"
     payment_method: PaymentMethod
+    order_id: Optional[str] = None  # Sent to the gateway so webhooks can be matched to the order
 
 # Admin Analytics Schemas
 class SalesStatsSchema(BaseModel):
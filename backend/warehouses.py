@@ -0,0 +1,71 @@
+import math
+from typing import Optional
+
+def _to_xyz(latitude: float, longitude: float) -> tuple:
+    """Unit-sphere point; straight-line distance between these orders like great-circle distance"""
+    lat = math.radians(latitude)
+    lon = math.radians(longitude)
+    return (math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon), math.sin(lat))
+
+def _chord_sq(a: tuple, b: tuple) -> float:
+    return (a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2 + (a[2] - b[2]) ** 2
+
+class WarehouseIndex:
+    """KD-tree over warehouse coordinates for nearest-warehouse lookups"""
+    
+    def __init__(self, warehouses: list = ()):
+        self.warehouses = list(warehouses)
+        points = [(_to_xyz(w["latitude"], w["longitude"]), w) for w in self.warehouses]
+        self._root = self._build(points, 0)
+    
+    def __len__(self):
+        return len(self.warehouses)
+    
+    def _build(self, points: list, depth: int):
+        if not points:
+            return None
+        axis = depth % 3
+        points.sort(key=lambda p: p[0][axis])
+        mid = len(points) // 2
+        return (
+            points[mid],
+            axis,
+            self._build(points[:mid], depth + 1),
+            self._build(points[mid + 1:], depth + 1)
+        )
+    
+    def nearest(self, latitude: float, longitude: float) -> Optional[dict]:
+        """The warehouse closest to a coordinate, or None if the index is empty"""
+        target = _to_xyz(latitude, longitude)
+        best = [None, float("inf")]
+        
+        def search(node):
+            if node is None:
+                return
+            (point, warehouse), axis, left, right = node
+            dist = _chord_sq(point, target)
+            if dist < best[1]:
+                best[0], best[1] = warehouse, dist
+            diff = target[axis] - point[axis]
+            near, far = (left, right) if diff < 0 else (right, left)
+            search(near)
+            if diff * diff < best[1]:
+                search(far)
+        
+        search(self._root)
+        return best[0]
+
+warehouse_index = WarehouseIndex()
+
+async def load_warehouses(warehouses_collection) -> WarehouseIndex:
+    """Rebuild the module-level index from active warehouses"""
+    global warehouse_index
+    docs = []
+    async for w in warehouses_collection.find({"is_active": True}):
+        w["_id"] = str(w["_id"])
+        docs.append(w)
+    warehouse_index = WarehouseIndex(docs)
+    return warehouse_index
+
+def nearest_warehouse(latitude: float, longitude: float) -> Optional[dict]:
+    return warehouse_index.nearest(latitude, longitude)
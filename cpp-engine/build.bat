@@ -1,6 +1,6 @@
 @echo off
 echo Building discount.dll for Windows...
-g++ -shared -o discount.dll discount.cpp -fPIC
+g++ -shared -o discount.dll discount.cpp -fPIC -O3
 if %ERRORLEVEL% EQU 0 (
     echo Build successful! discount.dll created.
 ) else (
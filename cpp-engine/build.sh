@@ -1,6 +1,6 @@
 #!/bin/bash
 echo "Building discount.so for Linux/Mac..."
-g++ -shared -o discount.so discount.cpp -fPIC
+g++ -shared -o discount.so discount.cpp -fPIC -O3
 if [ $? -eq 0 ]; then
     echo "Build successful! discount.so created."
 else
@@ -4,3 +4,12 @@ double applyDiscount(double price, int percent) {
     if (percent < 0 || percent > 70) return price;
     return price - (price * percent / 100.0);
 }
+
+// Batch variant: one call for a whole price list. out may alias prices.
+void applyDiscountBatch(const double* prices, const int* percents, double* out, int count) {
+    for (int i = 0; i < count; i++) {
+        double price = prices[i];
+        int percent = percents[i];
+        out[i] = (percent < 0 || percent > 70) ? price : price - (price * percent / 100.0);
+    }
+}
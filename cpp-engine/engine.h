@@ -3,6 +3,7 @@
 
 extern "C" {
     double applyDiscount(double price, int percent);
+    void applyDiscountBatch(const double* prices, const int* percents, double* out, int count);
 }
 
 #endif
@@ -1,5 +1,5 @@
 import { useEffect, useState } from "react";
-import api from "../src/api";
+import api, { getAllPages } from "../src/api";
 
 export default function Admin() {
   const [products, setProducts] = useState([]);
@@ -18,8 +18,7 @@ export default function Admin() {
 
   const loadProducts = async () => {
     try {
-      const res = await api.get("/products");
-      setProducts(res.data);
+      setProducts(await getAllPages("/products"));
     } catch (err) {
       console.error("Failed to load products", err);
     } finally {
@@ -6,6 +6,8 @@ export default function Products() {
   const [products, setProducts] = useState([]);
   const [cart, setCart] = useState([]);
   const [loading, setLoading] = useState(true);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const navigate = useNavigate();
 
   useEffect(() => {
@@ -13,10 +15,16 @@ export default function Products() {
     loadCart();
   }, []);
 
+  // One page per request; the next page is fetched from X-Next-Cursor on demand
+  const fetchPage = async (cursor) => {
+    const res = await api.get("/products", { params: cursor ? { cursor } : {} });
+    setProducts((prev) => (cursor ? [...prev, ...res.data] : res.data));
+    setNextCursor(res.headers["x-next-cursor"] || null);
+  };
+
   const loadProducts = async () => {
     try {
-      const res = await api.get("/products");
-      setProducts(res.data);
+      await fetchPage(null);
     } catch (err) {
       console.error("Failed to load products", err);
     } finally {
@@ -24,6 +32,17 @@ export default function Products() {
     }
   };
 
+  const loadMore = async () => {
+    setLoadingMore(true);
+    try {
+      await fetchPage(nextCursor);
+    } catch (err) {
+      console.error("Failed to load more products", err);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const loadCart = () => {
     const savedCart = JSON.parse(localStorage.getItem("cart") || "[]");
     setCart(savedCart);
@@ -81,6 +100,12 @@ export default function Products() {
           ))
         )}
       </div>
+
+      {nextCursor && (
+        <button style={styles.loadMoreButton} onClick={loadMore} disabled={loadingMore}>
+          {loadingMore ? "Loading..." : "Load more"}
+        </button>
+      )}
     </div>
   );
 }
@@ -159,6 +184,17 @@ const styles = {
     backgroundColor: "#bdc3c7",
     cursor: "not-allowed",
   },
+  loadMoreButton: {
+    display: "block",
+    margin: "2rem auto 0",
+    padding: "0.75rem 2rem",
+    backgroundColor: "#3498db",
+    color: "white",
+    border: "none",
+    borderRadius: "4px",
+    cursor: "pointer",
+    fontSize: "1rem",
+  },
   empty: {
     textAlign: "center",
     color: "#7f8c8d",
@@ -26,5 +26,19 @@ api.interceptors.response.use(
   }
 );
 
+// Whole listing for admin screens: follow X-Next-Cursor until the last page
+export const getAllPages = async (path, params = {}) => {
+  const items = [];
+  let cursor = null;
+  do {
+    const res = await api.get(path, {
+      params: { limit: 200, ...params, ...(cursor ? { cursor } : {}) },
+    });
+    items.push(...res.data);
+    cursor = res.headers["x-next-cursor"];
+  } while (cursor);
+  return items;
+};
+
 export default api;
 